@@ -1 +1,3 @@
 VERSION = "0.2.7"
+
+from .api import BuildResult, build
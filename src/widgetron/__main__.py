@@ -1,41 +1,60 @@
+import filecmp
 from hashlib import sha256
 import os
+import platform
 import re
-import shutil
 import sys
+import threading
 from pathlib import Path
 
-from .utils.conda import uninstall_widgetron, create_sbom
-
-from .globals import CONFIG
+# Only cheap modules are imported here, so that `widgetron -h` and the
+# lightweight stages start quickly. Stages import what they need.
+from . import constants
 from .constants import (
-    CONSTRUCTOR,
-    CONDA,
+    SUBDIR,
     TEMP_DIR,
     WIN,
     LINUX,
     OSX,
-    NPM,
     DEFAULT_SERVER_COMMAND,
+    KIOSK_SERVER_COMMAND,
+    SERVER_URLS,
     DEFAULT_ICON,
+    CACHE_DIR,
 )
-from .globals import CONSTRUCTOR_PARAMS
-from .utils.shell import SHELL
-from .utils.jinja_functions import render_templates
-
-
-def parse_arguments():
-    kwargs = CONFIG
+from .parse_args import as_bool, config
+from .utils.cache import BuildCache, digest
+from .utils.shell import SHELL, Shell, use_shell
+from .utils.pipeline import Pipeline, Stage
+from .utils.profile import Profiler, use_profiler
+from .utils.sync import sync_tree
+
+
+def parse_arguments(argv=None, overrides=None, cwd=None):
+    kwargs = config(argv, overrides, cwd)
+    # Every build gets its own shell, SHELL refers to it within this context
+    kwargs["shell"] = use_shell(
+        Shell(
+            mock=kwargs["dry_run"],
+            log=kwargs.get("command_log", None),
+            staging=kwargs["staging"],
+        )
+    )
+    kwargs["profiler"] = use_profiler(Profiler(enabled=bool(kwargs.get("profile"))))
+    # See `constructor_settings`
+    kwargs["constructor_options"] = dict(kwargs)
+    kwargs["constructor_lock"] = threading.Lock()
 
     if kwargs["python_version"] == "auto":
         kwargs["python_version"] = ".".join(list(map(str, sys.version_info[:2])))
     if kwargs["license_file"]:
         kwargs["license_file"] = str(Path(kwargs["license_file"]).resolve())
 
-    SHELL.mock = kwargs["dry_run"]
-    SHELL.log = kwargs.get("command_log", None)
-
-    kwargs["server_command"] = kwargs.get("server_command", DEFAULT_SERVER_COMMAND)
+    assert kwargs["server_mode"] in ("lab", "kiosk"), "server_mode: lab or kiosk"
+    kiosk = kwargs["server_mode"] == "kiosk"
+    kwargs["server_command"] = kwargs.get(
+        "server_command", KIOSK_SERVER_COMMAND if kiosk else DEFAULT_SERVER_COMMAND
+    )
     if isinstance(kwargs["server_command"], str):
         kwargs["server_command"] = kwargs["server_command"].strip().split()
 
@@ -56,96 +75,316 @@ def parse_arguments():
 
     kwargs["icon"] = kwargs.get("icon", DEFAULT_ICON)
     kwargs["icon_name"] = Path(kwargs["icon"]).name
-    kwargs["name"] = Path(kwargs["notebook"]).stem
+    kwargs["name"] = kwargs.get("name") or Path(kwargs["notebook"]).stem
 
     pat = re.compile(r"[^a-zA-Z0-9]")
     kwargs["name_nospace"] = pat.sub("_", kwargs["name"])
 
     kwargs["filename"] = Path(kwargs["notebook"]).name
+    kwargs["labextensions"] = kwargs.get("labextensions") or []
+    kwargs["prune_labextensions"] = bool(kwargs["labextensions"])
+    kwargs["strip_source_maps"] = as_bool(kwargs["strip_source_maps"])
+    kwargs["precompile"] = as_bool(kwargs["precompile"])
+    kwargs["lock_environment"] = as_bool(kwargs["lock_environment"])
+    kwargs["electron_clear_cache"] = as_bool(kwargs["electron_clear_cache"])
+    kwargs["single_instance"] = as_bool(kwargs["single_instance"])
+    kwargs["snapshot"] = as_bool(kwargs["snapshot"])
+    kwargs["sync_hash"] = as_bool(kwargs["sync_hash"])
+    kwargs["precompile_optimize"] = int(kwargs["precompile_optimize"])
+    assert kwargs["precompile_optimize"] in (0, 1, 2), "precompile_optimize: 0, 1 or 2"
+    mode = kwargs["server_mode"]
+    if kiosk and Path(kwargs["notebook"]).is_dir():
+        mode = "kiosk_dir"
+    kwargs["url_path"] = SERVER_URLS[mode]
+    if kiosk:
+        check_kiosk_requirements(kwargs)
 
     kwargs["temp_dir"] = Path(kwargs.get("temp_dir", TEMP_DIR)).resolve()
     kwargs["pkg_output_dir"] = str(
         kwargs.get("pkg_output_dir", kwargs["temp_dir"] / "conda-bld")
     )
 
-    CONSTRUCTOR_PARAMS.name = kwargs["name"]
-    CONSTRUCTOR_PARAMS.version = kwargs["version"]
-    CONSTRUCTOR_PARAMS.validate()
+    kwargs["jobs"] = int(kwargs["jobs"])
+    assert kwargs["package_mode"] in ("native", "boa"), "package_mode: native or boa"
+
+    kwargs["cache_dir"] = Path(kwargs.get("cache_dir", CACHE_DIR)).expanduser()
+    kwargs["cache"] = BuildCache(
+        kwargs["cache_dir"],
+        enabled=not (as_bool(kwargs["no_cache"]) or kwargs["dry_run"]),
+    )
+    if kwargs["cache"].enabled:
+        from .utils.jinja_functions import use_bytecode_cache
+        from .utils.repodata import INDEX
+
+        INDEX.cache_dir = kwargs["cache"].root / "repodata"
+        use_bytecode_cache(kwargs["cache"].root / "jinja")
+    # Outputs (relative to temp_dir) written during this build. Stages use it
+    # to skip work whose inputs are unchanged.
+    kwargs["changed"] = set()
 
     return kwargs
 
 
+def constructor_settings(kwargs):
+    """
+    The ConstructorSettings of the build, created by the first stage that
+    needs them (importing and validating them is slow, and not needed for
+    e.g. `--template_only`).
+    """
+    with kwargs["constructor_lock"]:
+        if kwargs.get("constructor") is None:
+            from .utils.settings import ConstructorSettings
+
+            params = ConstructorSettings(
+                path=kwargs["temp_dir"] / "constructor",
+                **kwargs["constructor_options"],
+            )
+            params.name = kwargs["name"]
+            params.version = kwargs["version"]
+            params.validate()
+            kwargs["constructor"] = params
+    return kwargs["constructor"]
+
+
+def check_kiosk_requirements(kwargs):
+    from .utils.conda import is_installed, spec_name
+
+    if kwargs.get("environment"):
+        assert is_installed(
+            kwargs["environment"], "voila"
+        ), "server_mode kiosk requires voila to be installed in the environment"
+    elif kwargs.get("dependencies"):
+        assert any(
+            spec_name(x) == "voila" for x in kwargs["dependencies"]
+        ), "server_mode kiosk requires voila in the dependencies"
+
+
+def notebook_sources(kwargs) -> dict:
+    """The `sync_tree` arguments selecting the files shipped from `notebook`."""
+    nb = Path(kwargs["notebook"])
+    if nb.is_file():
+        assert nb.suffix.lower() == ".ipynb", f"{nb} is not a notebook"
+        return dict(src=nb.parent, files=[nb.name])
+    assert list(nb.glob("*.ipynb")), f"No notebooks found in {nb}"
+    return dict(
+        src=nb,
+        prefix=nb.stem,
+        ignore=[".ipynb_checkpoints", "__pycache__"],
+        include=kwargs.get("notebook_include") or (),
+        exclude=kwargs.get("notebook_exclude") or (),
+    )
+
+
 def copy_notebook(kwargs):
     # Copy notebook into template
     # Check filetype
     server = kwargs["temp_dir"] / "server"
     dest = server / "widgetron_app/notebooks"
-    nb = Path(kwargs["notebook"])
 
     if kwargs.get("license_file"):
-        SHELL.copy(kwargs["license_file"], server / "LICENSE.txt")
-
-    if dest.exists():
-        shutil.rmtree(dest)
-    dest.mkdir()
-
-    if nb.is_file():
-        assert nb.suffix.lower() == ".ipynb", f"{nb} is not a notebook"
-        SHELL.copy(nb, dest / nb.name)
+        license_file = Path(kwargs["license_file"])
+        target = server / "LICENSE.txt"
+        if not (target.is_file() and filecmp.cmp(license_file, target, shallow=False)):
+            SHELL.copy(license_file, target)
+            kwargs["changed"].add("server/LICENSE.txt")
+
+    changed = sync_tree(
+        dst=dest,
+        manifest=kwargs["temp_dir"] / "notebooks.manifest.json",
+        use_hash=kwargs["sync_hash"],
+        **notebook_sources(kwargs),
+    )
+    print(f"Synced notebooks ({len(changed)} files changed)")
+    kwargs["changed"].update(f"server/widgetron_app/notebooks/{x}" for x in changed)
+
+
+def snapshot_notebooks(kwargs) -> int:
+    """
+    Execute the packaged notebooks and store their outputs and widget state,
+    so the app can show them before the kernel is ready. Outputs depend on
+    more than the notebook (data files, modules, the environment), so the
+    notebooks are executed on every build.
+    """
+    if not kwargs["snapshot"]:
+        return 0
+    dest = kwargs["temp_dir"] / "server/widgetron_app/notebooks"
+    cmd = [
+        "jupyter",
+        "nbconvert",
+        "--to=notebook",
+        "--execute",
+        "--inplace",
+        f"--ExecutePreprocessor.timeout={kwargs['snapshot_timeout']}",
+        "--ExecutePreprocessor.store_widget_state=True",
+    ]
+    if kwargs.get("environment"):
+        prefix = str(constructor_settings(kwargs).environment)
+        cmd = [constants.CONDA, "run", "--prefix", prefix, *cmd]
     else:
-        dest = dest / nb.stem
-        if dest.exists():
-            shutil.rmtree(dest)
-        assert list(nb.glob("*.ipynb")), f"No notebooks found in {nb}"
-        ignore = [".ipynb_checkpoints", "__pycache__"]
-        SHELL.copytree(src=nb, dst=dest, ignore=shutil.ignore_patterns(*ignore))
+        cmd = [sys.executable, "-m", *cmd]
+
+    for nb in sorted(dest.rglob("*.ipynb")):
+        if ".ipynb_checkpoints" in nb.parts:
+            continue
+        SHELL.detach(nb)  # The staged notebook may be a hardlink to the source
+        rc = SHELL.call([*cmd, nb.name], cwd=str(nb.parent))
+        if rc:
+            print(f"Failed to execute {nb.name}")
+            return rc
+        kwargs["changed"].add(nb.relative_to(kwargs["temp_dir"]).as_posix())
+    return 0
+
+
+def electron_cache_key(kwargs) -> str:
+    from .utils.jinja_functions import rendered_files
+
+    return digest(
+        *[kwargs["temp_dir"] / f for f in rendered_files("electron")],
+        Path(kwargs["icon"]).resolve(),
+        kwargs["electron_version"],
+        kwargs["electron_builder_version"],
+        platform.system(),
+        platform.machine(),
+    )
 
 
 def package_electron_app(kwargs):
+    cache = kwargs["cache"]
+    key = electron_cache_key(kwargs)
+    dest = kwargs["temp_dir"] / "server/widgetron_app"
+    sbom = None if kwargs["skip_sbom"] else Path(kwargs["outdir"]) / "npm-sbom.json"
+
+    stamp = dest / "ui.stamp"
+    staged = stamp.is_file() and stamp.read_text() == key and list(dest.glob("*.zip"))
+    if sbom is None and staged:
+        print("Electron app is up to date")
+        return 0
+
+    hit = cache.get("electron", key)
+    if hit and (sbom is None or (hit / sbom.name).exists()):
+        print(f"Using cached electron build ({key[:12]})")
+        for z in dest.glob("*.zip"):
+            SHELL.remove(z)
+        for z in hit.glob("*.zip"):
+            SHELL.stage(z, dest / z.name, read_only=True)
+        if sbom:
+            SHELL.copy(hit / sbom.name, sbom)
+        if not SHELL.mock:
+            stamp.write_text(key)
+        kwargs["changed"].add("server/widgetron_app/ui")
+        return 0
+
     icon = Path(kwargs["icon"]).resolve()
-    cwd = Path().resolve()
-    try:
-        SHELL.cd(kwargs["temp_dir"] / "electron")
-        Path("build").mkdir(exist_ok=True)
-        # assert icon.suffix.lower() == ".png", "WIP: only png currently supported"
-        SHELL.copy(str(icon), f"build/icon{icon.suffix}")
-
-        SHELL.call([NPM, "install", ".", "--no-optional"])
-
-        SHELL.call([NPM, "run", "build"])
-
-        env = os.environ
-        env["FETCH_LICENSE"] = "1"
-
-        if not kwargs["skip_sbom"]:
-            sbom = Path(kwargs["outdir"]) / "npm-sbom.json"
-            cmd = [
-                NPM,
-                "run",
-                "lock",
-                "--",
-                "--output-format",
-                "json",
-                "--output-file",
-                f"{sbom}",
-            ]
-            SHELL.call(cmd, env=env)
-
-        if OSX or LINUX:
-            dist = "dist"
-        elif WIN:
-            dist = "dist/win-unpacked"
-
-        SHELL.cd(dist)
-
-        if OSX or LINUX:
-            src = list(Path().glob("widgetron*.zip"))[0]
-            dst = "../../server/widgetron_app"
-            SHELL.move(src, dst / src)
-        elif WIN:
-            SHELL.zipdir(".", "../../../server/widgetron_app/ui.zip")
-    finally:
-        SHELL.cd(cwd)
+    electron = kwargs["temp_dir"] / "electron"
+    (electron / "build").mkdir(exist_ok=True)
+    # assert icon.suffix.lower() == ".png", "WIP: only png currently supported"
+    SHELL.copy(str(icon), electron / f"build/icon{icon.suffix}")
+
+    rc = SHELL.call(
+        [constants.NPM, "install", ".", "--no-optional"], cwd=str(electron)
+    )
+    if rc:
+        return rc
+
+    rc = SHELL.call([constants.NPM, "run", "build"], cwd=str(electron))
+    if rc:
+        return rc
+
+    if sbom:
+        env = dict(os.environ, FETCH_LICENSE="1")
+        cmd = [
+            constants.NPM,
+            "run",
+            "lock",
+            "--",
+            "--output-format",
+            "json",
+            "--output-file",
+            f"{sbom}",
+        ]
+        rc = SHELL.call(cmd, cwd=str(electron), env=env)
+        if rc:
+            return rc
+
+    for z in dest.glob("*.zip"):
+        SHELL.remove(z)
+    if OSX or LINUX:
+        for src in (electron / "dist").glob("widgetron*.zip"):
+            SHELL.move(src, dest / src.name)
+    elif WIN:
+        SHELL.zipdir(electron / "dist/win-unpacked", dest / "ui.zip")
+    # Never cache (or stamp) a build that produced no app
+    assert SHELL.mock or list(dest.glob("*.zip")), "The electron build produced no app"
+
+    cache.put("electron", key, [*dest.glob("*.zip"), *([sbom] if sbom else [])])
+    if not SHELL.mock:
+        stamp.write_text(key)
+    kwargs["changed"].add("server/widgetron_app/ui")
+    return 0
+
+
+def build_native_package(kwargs) -> int:
+    """
+    The electron shell and launcher change rarely while notebooks change on
+    almost every build, so they are split into two packages:
+      widgetron_app: everything in server/widgetron_app except notebooks/
+      widgetron_app_notebooks: server/widgetron_app/notebooks
+    Each is content hashed, so an unchanged runtime is reused as is.
+    """
+    from .utils.package import (
+        build_package,
+        collect_files,
+        compile_bytecode,
+        site_packages,
+    )
+
+    python_version = kwargs["python_version"]
+    build_prefix = f"py{python_version.replace('.', '')}"
+    src = kwargs["temp_dir"] / "server/widgetron_app"
+    dst = f"{site_packages(python_version)}/widgetron_app"
+
+    files = collect_files(src, prefix=dst, exclude=("notebooks",))
+    # Unpack the UI at install time rather than on first launch
+    recipe = kwargs["temp_dir"] / "recipe"
+    if WIN:
+        files["Scripts/.widgetron_app-post-link.bat"] = recipe / "post-link.bat"
+    else:
+        files["bin/.widgetron_app-post-link.sh"] = recipe / "post-link.sh"
+
+    notebooks = collect_files(src / "notebooks", prefix=f"{dst}/notebooks")
+
+    # Bytecode can only be shipped if it is compiled by the target python
+    running = ".".join(map(str, sys.version_info[:2]))
+    if kwargs["precompile"] and python_version == running:
+        pyc = dict(
+            out_dir=kwargs["temp_dir"] / "pyc",
+            optimize=kwargs["precompile_optimize"],
+            invalidation_mode=kwargs["precompile_invalidation"],
+        )
+        files.update(compile_bytecode(files, **pyc))
+        notebooks.update(compile_bytecode(notebooks, **pyc))
+
+    runtime = build_package(
+        name="widgetron_app",
+        version="0.0.1",
+        build_prefix=build_prefix,
+        files=files,
+        depends=[f"python {python_version}.*"],
+        output_dir=kwargs["pkg_output_dir"],
+    )
+    content = build_package(
+        name="widgetron_app_notebooks",
+        version=str(kwargs["version"]),
+        build_prefix=build_prefix,
+        files=notebooks,
+        depends=[f"widgetron_app {runtime['version']} {runtime['build']}"],
+        output_dir=kwargs["pkg_output_dir"],
+    )
+    kwargs["widgetron_packages"] = {
+        runtime["name"]: runtime["build"],
+        content["name"]: content["build"],
+    }
+    return 0
 
 
 def get_conda_build_args(recipe_dir: Path, output_dir: Path) -> list[str]:
@@ -164,6 +403,9 @@ def get_conda_build_args(recipe_dir: Path, output_dir: Path) -> list[str]:
 
 def build_sdist_package(kwargs) -> int:
     srcdir = kwargs["temp_dir"] / "server"
+    if not changed(kwargs, "server/") and list((srcdir / "dist").glob("*.tar.gz")):
+        print("sdist is up to date")
+        return 0
     cmd = ["python", "setup.py", "sdist"]
     return SHELL.call(cmd, cwd=str(srcdir))
 
@@ -182,46 +424,230 @@ def get_conda_build_env(kwargs) -> dict[str, str]:
 
 def build_conda_package(kwargs) -> int:
     dir = kwargs["temp_dir"] / "recipe"
-    rc = SHELL.call(
+    return SHELL.call(
         get_conda_build_args(Path(dir), kwargs["pkg_output_dir"]),
         env=get_conda_build_env(kwargs),
     )
-    if CONSTRUCTOR_PARAMS.environment:
-        uninstall_widgetron(CONSTRUCTOR_PARAMS.environment)
-    CONSTRUCTOR_PARAMS.add_dependency(
-        package="widgetron_app",
-        channel=kwargs["pkg_output_dir"],
+
+
+def solve_environment(kwargs) -> int:
+    from .utils.conda import solve_explicit
+
+    params = constructor_settings(kwargs)
+    if not (kwargs["lock_environment"] and params.specs):
+        return 0
+    if not constants.CONDA_LOCK:
+        print("conda-lock not found, constructor will solve the environment instead")
+        return 0
+    lockfile = kwargs["temp_dir"] / "solve" / f"conda-{SUBDIR}.lock"
+    rc = solve_explicit(
+        specs=params.specs,
+        channels=params.channels,
+        python_version=kwargs["python_version"],
+        lockfile=lockfile,
+        cache=kwargs["cache"],
     )
-    if (not kwargs["skip_sbom"]) and CONSTRUCTOR_PARAMS.environment_file:
+    if rc or SHELL.mock:
+        return rc
+    params.lock(lockfile)
+    return 0
+
+
+def add_widgetron_app(kwargs) -> int:
+    from .utils.conda import uninstall_widgetron
+
+    params = constructor_settings(kwargs)
+    if params.environment:
+        uninstall_widgetron(params.environment)
+    # boa builds a single widgetron_app package and does not report its build
+    packages = kwargs.get("widgetron_packages") or {"widgetron_app": None}
+    rc = 0
+    for package, build in packages.items():
+        rc = rc or params.add_dependency(
+            package=package,
+            channel=kwargs["pkg_output_dir"],
+            **({"build": build} if build else {}),
+        )
+    return rc
+
+
+def build_conda_sbom(kwargs):
+    from .utils.conda import create_sbom
+
+    params = constructor_settings(kwargs)
+    if (not kwargs["skip_sbom"]) and params.environment_file:
         create_sbom(
-            CONSTRUCTOR_PARAMS.environment_file,
+            params.environment_file,
             Path(kwargs["outdir"]) / "conda-sbom.json",
         )
-    return rc
+
+
+def write_post_install(kwargs) -> int:
+    """
+    Run the widgetron_app install steps (prune, precompile) once the installer
+    has created the environment, followed by the user's own post_install
+    script (if any).
+    """
+    modules = []
+    if kwargs["prune_labextensions"] or kwargs["strip_source_maps"]:
+        modules.append("widgetron_app.prune")
+    if kwargs["precompile"]:
+        modules.append("widgetron_app.precompile")
+    if not modules:
+        return 0
+    if WIN:
+        script = kwargs["temp_dir"] / "post_install/post_install.bat"
+        lines = [f'"%PREFIX%\\python.exe" -m {m}' for m in modules]
+    else:
+        script = kwargs["temp_dir"] / "post_install/post_install.sh"
+        lines = ["#!/bin/bash", *[f'"${{PREFIX}}/bin/python" -m {m}' for m in modules]]
+    if kwargs.get("post_install"):
+        lines.append(Path(kwargs["post_install"]).read_text())
+    if SHELL.mock:
+        return 0
+    script.parent.mkdir(parents=True, exist_ok=True)
+    script.write_text("\n".join(lines) + "\n")
+    constructor_settings(kwargs).post_install = str(script)
+    return 0
 
 
 def build_installer(kwargs):
-    dir = CONSTRUCTOR_PARAMS.path
-    cmd = [CONSTRUCTOR, str(dir), "--output-dir", str(kwargs["outdir"])]
-    return SHELL.call(cmd)
+    from .api import INSTALLER_SUFFIXES
+
+    dir = constructor_settings(kwargs).path
+    # Built in the work directory first, so that the installers of this build
+    # can be told apart from others in (a shared) outdir
+    staging = kwargs["temp_dir"] / "installer"
+    if staging.is_dir():
+        for p in staging.iterdir():
+            if p.is_file():
+                SHELL.remove(p)
+    staging.mkdir(exist_ok=True)
+    cmd = [constants.CONSTRUCTOR, str(dir), "--output-dir", str(staging)]
+    rc = SHELL.call(cmd)
+    if rc:
+        return rc
+    outdir = Path(kwargs["outdir"])
+    kwargs["installers"] = []
+    for p in sorted(x for x in staging.iterdir() if x.is_file()):
+        SHELL.remove(outdir / p.name)
+        SHELL.move(p, outdir / p.name)
+        if p.suffix in INSTALLER_SUFFIXES:
+            kwargs["installers"].append(outdir / p.name)
+    return 0
+
+
+def render(kwargs):
+    from .utils.jinja_functions import render_templates
+
+    changed = render_templates(**kwargs)
+    kwargs["changed"].update(p.as_posix() for p in changed)
+
+
+def changed(kwargs, prefix: str) -> bool:
+    return any(p.startswith(prefix) for p in kwargs["changed"])
+
+
+def build_pipeline(kwargs) -> Pipeline:
+    stages = [
+        Stage("render", render, outputs=["templates"]),
+        Stage(
+            "copy_notebook",
+            copy_notebook,
+            inputs=["templates"],
+            outputs=["notebooks"],
+        ),
+        Stage(
+            "snapshot_notebooks",
+            snapshot_notebooks,
+            inputs=["notebooks"],
+            outputs=["notebook_outputs"],
+        ),
+    ]
+    if kwargs["template_only"]:
+        return Pipeline(stages)
+
+    stages += [
+        Stage("solve_environment", solve_environment, outputs=["environment_lock"]),
+        Stage(
+            "package_electron_app",
+            package_electron_app,
+            inputs=["templates"],
+            outputs=["electron_app"],
+        ),
+    ]
+    if kwargs["package_mode"] == "native":
+        stages += [
+            Stage(
+                "build_conda_package",
+                build_native_package,
+                inputs=["templates", "notebook_outputs", "electron_app"],
+                outputs=["widgetron_app"],
+            ),
+        ]
+    else:
+        stages += [
+            Stage(
+                "build_sdist_package",
+                build_sdist_package,
+                inputs=["templates", "notebook_outputs", "electron_app"],
+                outputs=["sdist"],
+            ),
+            Stage(
+                "build_conda_package",
+                build_conda_package,
+                inputs=["sdist"],
+                outputs=["widgetron_app"],
+            ),
+        ]
+    stages += [
+        Stage(
+            "add_widgetron_app",
+            add_widgetron_app,
+            inputs=["widgetron_app", "environment_lock"],
+            outputs=["environment_spec"],
+        ),
+        Stage("build_conda_sbom", build_conda_sbom, inputs=["environment_spec"]),
+        Stage(
+            "write_post_install",
+            write_post_install,
+            inputs=["environment_spec"],
+            outputs=["post_install"],
+        ),
+        Stage(
+            "build_installer",
+            build_installer,
+            inputs=["environment_spec", "post_install"],
+            outputs=["installer"],
+        ),
+    ]
+    return Pipeline(stages)
 
 
-def cli():
-    kwargs = parse_arguments()
+def run(kwargs) -> int:
+    try:
+        return build_pipeline(kwargs).run(kwargs, jobs=kwargs["jobs"])
+    finally:
+        if kwargs.get("profile"):
+            kwargs["profiler"].write_trace(kwargs["profile"])
+            print(kwargs["profiler"].summary())
+            print(f"Trace written to {kwargs['profile']}")
 
-    render_templates(**kwargs)
 
-    copy_notebook(kwargs)
+def cli():
+    if sys.argv[1:2] == ["serve"]:
+        from .serve import main
 
-    if kwargs["template_only"]:
-        sys.exit(0)
+        sys.exit(main(sys.argv[2:]))
+    if sys.argv[1:2] == ["batch"]:
+        from .batch import main
 
-    package_electron_app(kwargs)
-    rc = build_sdist_package(kwargs)
-    rc = rc or build_conda_package(kwargs)
-    rc = rc or build_installer(kwargs)
+        sys.exit(main(sys.argv[2:]))
+    if sys.argv[1:2] == ["dev"]:
+        from .dev import main
 
-    sys.exit(rc)
+        sys.exit(main(sys.argv[2:]))
+    sys.exit(run(parse_arguments()))
 
 
 if __name__ == "__main__":
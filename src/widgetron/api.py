@@ -0,0 +1,59 @@
+import contextvars
+import time
+from dataclasses import dataclass, field
+from pathlib import Path
+
+INSTALLER_SUFFIXES = (".sh", ".exe", ".pkg")
+
+
+@dataclass
+class BuildResult:
+    returncode: int
+    outdir: Path
+    temp_dir: Path
+    duration: float
+    installers: list[Path] = field(default_factory=list)
+    # name -> build string of the widgetron_app packages (native package_mode)
+    packages: dict[str, str] = field(default_factory=dict)
+
+    @property
+    def ok(self) -> bool:
+        return self.returncode == 0
+
+
+def _build(options: dict, cwd, output) -> BuildResult:
+    from .__main__ import parse_arguments, run
+
+    start = time.time()
+    kwargs = parse_arguments(argv=[], overrides=options, cwd=cwd)
+    kwargs["shell"].output = output
+    rc = run(kwargs)
+    outdir = Path(kwargs["outdir"])
+    return BuildResult(
+        returncode=rc,
+        outdir=outdir,
+        temp_dir=Path(kwargs["temp_dir"]),
+        duration=time.time() - start,
+        installers=list(kwargs.get("installers") or []),
+        packages=dict(kwargs.get("widgetron_packages") or {}),
+    )
+
+
+def build(
+    config: dict | None = None, cwd=None, output=None, **options
+) -> BuildResult:
+    """
+    Build an app without starting a new process. `config` (and `options`)
+    take the same options as the `tool.widgetron` config section; the
+    config file in `directory` is read as for the CLI, but `sys.argv` is not.
+    Relative paths given in `config` are relative to `cwd` (default: the
+    working directory). `output`, if given, receives the output of the
+    commands run by the build line by line.
+
+    Each call has its own settings, shell and context, so builds may run
+    concurrently from several threads as long as they use different
+    `temp_dir`s. Caches (repodata, compiled templates, the build cache) are
+    shared between builds.
+    """
+    options = {**(config or {}), **options}
+    return contextvars.copy_context().run(_build, options, cwd, output)
@@ -0,0 +1,124 @@
+"""
+`widgetron batch`: build many apps from one manifest.
+
+    # apps.yml (paths are relative to this file)
+    defaults:            # options shared by every app
+      environment_yaml: environment.yml
+      channels: [conda-forge]
+    apps:
+      - notebook: sales.ipynb
+        icon: icons/sales.png
+        version: 1.2.0
+      - notebook: inventory
+        name: Inventory Manager
+        version: 0.4.1
+
+Work that apps have in common (the electron build, which no longer depends
+on the app's name or version, and the environment solve) is done once up
+front and picked up from the build cache by every app. The apps are then
+built in a process pool and publish their packages to one shared channel.
+"""
+import argparse
+import contextvars
+import os
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+from .api import BuildResult, build
+
+# Stages whose results (via the build cache) are the same for many apps
+SHARED_STAGES = ["package_electron_app", "solve_environment"]
+
+
+def load_manifest(path: Path) -> list[dict]:
+    """The options of each app, relative paths resolved against `path`."""
+    import yaml
+
+    class Loader(yaml.SafeLoader):
+        """Numbers as written, like the command line (`version: 1.10` is not 1.1)."""
+
+    for tag in ("int", "float"):
+        Loader.add_constructor(
+            f"tag:yaml.org,2002:{tag}", yaml.SafeLoader.construct_scalar
+        )
+
+    data = yaml.load(Path(path).read_text(), Loader=Loader)
+    defaults = data.get("defaults") or {}
+    apps = [{**defaults, **app} for app in data["apps"]]
+    for app in apps:
+        assert "notebook" in app, "Every app in the manifest needs a notebook"
+        # boa pins widgetron_app by name and version only, which could resolve
+        # to another app's package in the shared channel
+        assert app.get("package_mode", "native") == "native", (
+            "Batch builds need package_mode: native"
+        )
+    return apps
+
+
+def _prepare(options: dict, cwd: Path) -> int:
+    from .__main__ import build_pipeline, parse_arguments
+
+    kwargs = parse_arguments(argv=[], overrides=options, cwd=cwd)
+    pipeline = build_pipeline(kwargs).only(SHARED_STAGES)
+    return pipeline.run(kwargs, jobs=kwargs["jobs"])
+
+
+def build_batch(manifest: Path | str, jobs: int | None = None) -> list[BuildResult]:
+    manifest = Path(manifest).resolve()
+    root = manifest.parent
+    temp_dir = root / "widgetron_temp_files"
+    apps = []
+    seen = {}
+    for app in load_manifest(manifest):
+        name = app.get("name") or Path(app["notebook"]).stem
+        # One work directory per app, but a single local channel
+        work_dir = "_".join(name.split())
+        assert work_dir not in seen, (
+            f"{seen.get(work_dir)} and {app['notebook']} are both named {name!r}, "
+            "give them different names in the manifest"
+        )
+        seen[work_dir] = app["notebook"]
+        apps.append(
+            {
+                "temp_dir": str(temp_dir / "apps" / work_dir),
+                "pkg_output_dir": str(temp_dir / "conda-bld"),
+                "directory": str(root),
+                **app,
+                "name": name,
+                "package_mode": "native",
+            }
+        )
+
+    # Apps with identical settings hit the cache filled by the first one
+    for options in apps:
+        rc = contextvars.copy_context().run(_prepare, options, root)
+        if rc:
+            return [BuildResult(rc, root, Path(options["temp_dir"]), 0)]
+
+    results = []
+    with ProcessPoolExecutor(max_workers=jobs or os.cpu_count()) as pool:
+        futures = [pool.submit(build, options, cwd=root) for options in apps]
+        for options, future in zip(apps, futures):
+            try:
+                result = future.result()
+                status = "ok" if result.ok else f"failed ({result.returncode})"
+            except Exception as e:  # One broken app does not stop the others
+                result = BuildResult(1, root, Path(options["temp_dir"]), 0)
+                status = f"failed ({e!r})"
+            print(f"{options['name']}: {status} in {result.duration:.0f}s")
+            results.append(result)
+    return results
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(
+        prog="widgetron batch",
+        description="Build every app listed in a manifest.",
+    )
+    parser.add_argument("manifest", help="YAML file listing the apps to build.")
+    parser.add_argument(
+        "--jobs", "-j", type=int, help="Apps built at the same time (default: #cpus)."
+    )
+    args = parser.parse_args(argv)
+    results = build_batch(args.manifest, args.jobs)
+    return next((r.returncode for r in results if not r.ok), 0)
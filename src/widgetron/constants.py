@@ -1,18 +1,35 @@
+import os
 import platform
 import shutil
 import sys
+from functools import cache
 from pathlib import Path
 
 HERE = Path(__file__).parent
 PYTHON = Path(sys.executable)
 CONDA_PREFIX = PYTHON.parent
 TEMP_DIR = Path("widgetron_temp_files").resolve()
+CACHE_DIR = Path(
+    os.environ.get("WIDGETRON_CACHE_DIR", Path.home() / ".cache" / "widgetron")
+)
 DEFAULT_SERVER_COMMAND = ["jupyter", "lab", "--no-browser"]
+# Kiosk mode serves only the rendered notebook (voila running as a jupyter
+# server extension) instead of the full JupyterLab frontend.
+KIOSK_SERVER_COMMAND = ["jupyter", "server", "--no-browser"]
+SERVER_URLS = {
+    "lab": "/lab/tree/{filename}",
+    "kiosk": "/voila/render/{filename}",
+    "kiosk_dir": "/voila/tree/{filename}",
+}
 
-NPM = shutil.which("npm")
-CONDA = shutil.which("mamba") or shutil.which("conda")
-JAKE = shutil.which("jake")
-CONSTRUCTOR = shutil.which("constructor")
+# External tools, looked up on first use (see __getattr__)
+TOOLS = {
+    "NPM": ["npm"],
+    "CONDA": ["mamba", "conda"],
+    "JAKE": ["jake"],
+    "CONSTRUCTOR": ["constructor"],
+    "CONDA_LOCK": ["conda-lock"],
+}
 
 WIN = platform.system() == "Windows"
 LINUX = platform.system() == "Linux"
@@ -32,3 +49,25 @@ elif OSX:
     DEFAULT_ICON = (HERE / "icons/widgetron.icns").resolve()
 else:
     raise OSError(f"Unknown platform {platform.system()}")
+
+# conda subdir of the platform being built for
+SUBDIR = {
+    ("Windows", "amd64"): "win-64",
+    ("Windows", "arm64"): "win-arm64",
+    ("Linux", "x86_64"): "linux-64",
+    ("Linux", "aarch64"): "linux-aarch64",
+    ("Linux", "ppc64le"): "linux-ppc64le",
+    ("Darwin", "x86_64"): "osx-64",
+    ("Darwin", "arm64"): "osx-arm64",
+}.get((platform.system(), platform.machine().lower()))
+
+
+@cache
+def which(name: str) -> str | None:
+    return next(filter(None, map(shutil.which, TOOLS[name])), None)
+
+
+def __getattr__(name: str):
+    if name in TOOLS:
+        return which(name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
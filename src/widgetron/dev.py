@@ -0,0 +1,181 @@
+"""
+`widgetron dev`: edit notebooks and see them in the app within a second.
+
+Instead of rebuilding and reinstalling the widgetron_app packages, changed
+notebooks (and the source files next to them) are copied straight into the
+`widgetron_app/notebooks` directory installed in the environment, and the
+conda-meta entry of the package that owns them is updated to match. The
+environment must have been built once with `widgetron --environment ENV`.
+
+    widgetron dev --environment ./env --launch
+"""
+import argparse
+import os
+import signal
+import subprocess
+import time
+from pathlib import Path
+
+from .constants import WIN
+from .utils.cache import digest
+from .utils.shell import SHELL, Shell, use_shell
+from .utils.sync import sync_tree, walk_tree
+
+
+def installed_notebooks(env: Path) -> tuple[Path, Path]:
+    """
+    The notebooks directory of the installed widgetron_app (relative to
+    `env`), and the conda-meta entry of the package that owns it.
+    """
+    import json
+
+    from .utils.conda import installed_record
+
+    runtime = installed_record(env, "widgetron_app")
+    assert runtime, (
+        f"widgetron_app is not installed in {env}, "
+        "run `widgetron --environment ENV` once first"
+    )
+    files = json.loads(runtime.read_text())["files"]
+    cli = next(f for f in files if f.endswith("widgetron_app/cli.py"))
+    # The native package mode ships notebooks separately from the runtime
+    owner = installed_record(env, "widgetron_app_notebooks") or runtime
+    return Path(cli).parent / "notebooks", owner
+
+
+def scan(sources: dict) -> dict[str, tuple[int, int]]:
+    """Size and mtime of each file to sync, to notice changes cheaply."""
+    src = Path(sources["src"])
+    files = sources.get("files") or walk_tree(
+        src,
+        sources.get("ignore", ()),
+        sources.get("include", ()),
+        sources.get("exclude", ()),
+    )
+    state = {}
+    for rel in files:
+        try:
+            st = (src / rel).stat()
+        except FileNotFoundError:  # e.g. in the middle of an editor's save
+            continue
+        state[rel] = (st.st_size, st.st_mtime_ns)
+    return state
+
+
+def stale_bytecode(dst: Path, changed: list[str]) -> list[str]:
+    """Installed .pyc files of the changed sources (paths relative to `dst`)."""
+    stale = []
+    for rel in changed:
+        if rel.endswith(".py"):
+            cache = (dst / rel).parent / "__pycache__"
+            stem = Path(rel).stem
+            stale += [p.relative_to(dst).as_posix() for p in cache.glob(f"{stem}.*.pyc")]
+    return stale
+
+
+def launch(env: Path) -> subprocess.Popen:
+    python = env / "python.exe" if WIN else env / "bin/python"
+    # In its own process group, so the window and server can be stopped with it
+    if WIN:
+        group = dict(creationflags=subprocess.CREATE_NEW_PROCESS_GROUP)
+    else:
+        group = dict(start_new_session=True)
+    return subprocess.Popen([str(python), "-m", "widgetron_app"], **group)
+
+
+def stop(app: subprocess.Popen | None):
+    if app is None or app.poll() is not None:
+        return
+    if WIN:
+        subprocess.call(["taskkill", "/T", "/F", "/PID", str(app.pid)])
+    else:
+        # The launcher shuts its server down when interrupted
+        os.killpg(app.pid, signal.SIGINT)
+    try:
+        app.wait(timeout=10)
+    except subprocess.TimeoutExpired:
+        app.kill()
+        app.wait()
+
+
+def sync(kwargs, env: Path, sources: dict, files: list[str]) -> list[str]:
+    """Copy `files` into `env`. Returns the changed paths (relative to `env`)."""
+    from .utils.conda import update_installed_files
+
+    notebooks, owner = installed_notebooks(env)
+    dst = env / notebooks
+    changed = sync_tree(
+        dst=dst,
+        manifest=kwargs["temp_dir"] / "dev" / f"{digest(str(env))[:12]}.json",
+        keep=["__pycache__"],
+        **dict(sources, files=files),
+    )
+    for rel in stale_bytecode(dst, changed):
+        SHELL.remove(dst / rel)
+        changed.append(rel)
+    changed = [(notebooks / x).as_posix() for x in changed]
+    if changed and not SHELL.mock:
+        update_installed_files(owner, env, changed)
+    return changed
+
+
+def main(argv=None) -> int:
+    from .__main__ import notebook_sources
+    from .parse_args import config
+    from .utils.conda import find_env
+
+    parser = argparse.ArgumentParser(
+        prog="widgetron dev",
+        description=(
+            "Keep the notebooks installed in a prebuilt environment in sync "
+            "with their sources. Other widgetron options (e.g. --notebook, "
+            "--environment) are read as for a build."
+        ),
+    )
+    parser.add_argument(
+        "--interval", type=float, default=0.5, help="Seconds between checks."
+    )
+    parser.add_argument(
+        "--launch", action="store_true", help="Start the app, restart it on changes."
+    )
+    parser.add_argument("--once", action="store_true", help="Sync once and exit.")
+    args, rest = parser.parse_known_args(argv)
+
+    kwargs = config(rest)
+    if not kwargs.get("environment"):
+        parser.error("--environment is required")
+    env = Path(find_env(kwargs["environment"]))
+    use_shell(
+        Shell(
+            mock=kwargs["dry_run"],
+            log=kwargs.get("command_log"),
+            # The app may save notebooks in place, never share them with it
+            staging="copy" if kwargs["staging"] == "copy" else "reflink",
+        )
+    )
+    sources = notebook_sources(kwargs)
+
+    app = None
+    state = None
+    try:
+        while True:
+            current = scan(sources)
+            if current != state:
+                start = time.perf_counter()
+                changed = sync(kwargs, env, sources, list(current))
+                state = current
+                if changed:
+                    elapsed = time.perf_counter() - start
+                    print(f"Synced {len(changed)} files in {elapsed * 1000:.0f}ms")
+                if args.launch and (changed or app is None):
+                    stop(app)
+                    app = launch(env)
+            if args.once:
+                break
+            time.sleep(args.interval)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if not args.once:
+            stop(app)
+    return 0
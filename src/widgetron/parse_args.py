@@ -2,28 +2,100 @@ import argparse
 import configparser
 import json
 import os
+from functools import cache
 from pathlib import Path
 
-try:
-    import tomllib
-except ImportError:
-    import tomli as tomllib
-import yaml
+from .constants import CACHE_DIR
 
 HERE = Path(__file__).parent
 ARGS_FILE = HERE / "args.yml"
+# args.yml as JSON, which is much faster to load than YAML
+SCHEMA_CACHE = CACHE_DIR / "args.json"
 
 
-parser = argparse.ArgumentParser(
-    prog="widgetron",
-    description="Creates an app for displaying the output cells of an interactive notebook.",
+@cache
+def schema() -> dict:
+    """The contents of args.yml, cached on disk until args.yml changes."""
+    st = ARGS_FILE.stat()
+    stamp = [st.st_size, st.st_mtime_ns]
+    try:
+        cached = json.loads(SCHEMA_CACHE.read_text())
+        if cached["stamp"] == stamp:
+            return cached["args"]
+    except (OSError, ValueError, KeyError):
+        pass
+
+    import yaml
+
+    with ARGS_FILE.open() as f:
+        args = yaml.safe_load(f)
+    try:
+        SCHEMA_CACHE.parent.mkdir(parents=True, exist_ok=True)
+        tmp = SCHEMA_CACHE.with_suffix(f".{os.getpid()}.tmp")
+        tmp.write_text(json.dumps(dict(stamp=stamp, args=args)))
+        tmp.replace(SCHEMA_CACHE)
+    except OSError:
+        pass  # e.g. read-only home directory
+    return args
+
+
+def build_parser() -> tuple[argparse.ArgumentParser, dict]:
+    """The CLI parser and the defaults declared in args.yml."""
+    parser = argparse.ArgumentParser(
+        prog="widgetron",
+        description="Creates an app for displaying the output cells of an interactive notebook.",
+    )
+    defaults = {}
+    for k, v in schema().items():
+        v = dict(v)
+        if v.pop("positional", None):
+            flags = [k]
+        else:
+            flags = [f"--{k}"]
+        if "flag" in v:
+            flags += ["-" + v.pop("flag")]
+        if "default" in v:
+            defaults[k] = v.pop("default")
+        if "action" in v:
+            v["action"] = getattr(argparse, v["action"])
+        parser.add_argument(*flags, **v)
+    return parser, defaults
+
+
+# Options holding paths, which are relative to the build directory
+PATH_OPTIONS = (
+    "notebook",
+    "environment_yaml",
+    "explicit_lock",
+    "post_install",
+    "license_file",
+    "icon",
+    "welcome_image",
+    "header_image",
+    "nsis_template",
+    "pkg_output_dir",
+    "command_log",
+    "profile",
+    "cache_dir",
 )
 
 
-def config_file():
-    if Path("setup.cfg").is_file():
+def as_bool(value) -> bool:
+    """Booleans given on the command line or in setup.cfg are strings."""
+    if isinstance(value, str):
+        v = value.strip().lower()
+        if v in ("true", "yes", "on", "1"):
+            return True
+        if v in ("false", "no", "off", "0", ""):
+            return False
+        raise ValueError(f"Expected true or false, got {value!r}")
+    return bool(value)
+
+
+def config_file(directory: Path):
+    if (directory / "setup.cfg").is_file():
         setup_cfg = configparser.ConfigParser()
-        with Path("setup.cfg").open("r") as f:
+        with (directory / "setup.cfg").open("r") as f:
             setup_cfg.read_file(f)
         if "tool.widgetron" in setup_cfg:
             print("Initialize from setup.cfg")
@@ -34,8 +106,14 @@ def config_file():
                 data["dependencies"] = json.loads(data["dependencies"])
             return data
 
-    if Path("pyproject.toml").is_file():
-        _toml = tomllib.load(Path("pyproject.toml").open("rb"))
+    if (directory / "pyproject.toml").is_file():
+        try:
+            import tomllib
+        except ImportError:
+            import tomli as tomllib
+
+        with (directory / "pyproject.toml").open("rb") as f:
+            _toml = tomllib.load(f)
         if "tool" in _toml:
             if "widgetron" in _toml["tool"]:
                 print("Initialize from pyproject.toml")
@@ -43,48 +121,36 @@ def config_file():
     return {}
 
 
-def config():
-    defaults = {}
-    with ARGS_FILE.open() as f:
-        args = yaml.safe_load(f)
-    for k, v in args.items():
-        if v.pop("positional", None):
-            flags = [k]
-        else:
-            flags = [f"--{k}"]
-        if "flag" in v:
-            flags += ["-" + v.pop("flag")]
-        if "default" in v:
-            defaults[k] = v.pop("default")
-        if "action" in v:
-            v["action"] = getattr(argparse, v["action"])
-        parser.add_argument(*flags, **v)
-    kwargs = parser.parse_args()
+def config(argv=None, overrides: dict | None = None, cwd: Path | None = None):
+    """
+    Options for one build: args.yml defaults, then the config file in the
+    build directory, then `argv` (the command line) and `overrides`.
+    Relative paths are resolved against the build directory (or `cwd`, see
+    below), the process working directory is left alone.
+    """
+    cwd = Path(cwd or os.getcwd()).resolve()
+    parser, defaults = build_parser()
+    kwargs = {k: v for k, v in vars(parser.parse_args(argv)).items() if v is not None}
+    kwargs.update(overrides or {})
 
     # Outdir
     #  If provided to CLI, then relative to CWD
-    if kwargs.outdir is not None:
-        kwargs.outdir = Path(kwargs.outdir).resolve()
-    if kwargs.temp_dir is not None:
-        kwargs.temp_dir = Path(kwargs.temp_dir).resolve()
+    for k in ("outdir", "temp_dir"):
+        if k in kwargs:
+            kwargs[k] = (cwd / kwargs[k]).resolve()
     #  If unspecified, then CWD
-    defaults["outdir"] = Path(defaults["outdir"]).resolve()
-    defaults["temp_dir"] = Path(defaults["temp_dir"]).resolve()
+    defaults["outdir"] = (cwd / defaults["outdir"]).resolve()
+    defaults["temp_dir"] = (cwd / defaults["temp_dir"]).resolve()
 
-    # CD to the working directory
-    working_dir = kwargs.directory or defaults["directory"]
-    os.chdir(working_dir)
+    working_dir = (cwd / (kwargs.get("directory") or defaults["directory"])).resolve()
 
     # Load config file options (setup.cfg)
-    res = config_file()
+    res = config_file(working_dir)
 
     #  If outdir was specified in the config file, then it is relative to the config file
-    if "outdir" in res:
-        res["outdir"] = Path(res["outdir"]).resolve()
-    if "temp_dir" in res:
-        res["temp_dir"] = Path(res["temp_dir"]).resolve()
-    if "post_install" in res:
-        res["post_install"] = str(Path(res["post_install"]).resolve())
+    for k in ("outdir", "temp_dir"):
+        if k in res:
+            res[k] = (working_dir / res[k]).resolve()
 
     # Apply defaults as specified in args.yml
     for k, v in defaults.items():
@@ -92,7 +158,19 @@ def config():
             res[k] = v
 
     # Override config and defaults with cli args
-    res.update({k: v for k, v in kwargs.__dict__.items() if v is not None})
+    res.update(kwargs)
+    res["directory"] = working_dir
+    for k in PATH_OPTIONS:
+        if res.get(k):
+            res[k] = str((working_dir / Path(res[k]).expanduser()).resolve())
+    # Environments and channels may also be names
+    if res.get("environment") and (working_dir / res["environment"]).exists():
+        res["environment"] = str((working_dir / res["environment"]).resolve())
+    if res.get("channels"):
+        res["channels"] = [
+            str((working_dir / c).resolve()) if (working_dir / c).is_dir() else c
+            for c in res["channels"]
+        ]
     res["outdir"].mkdir(exist_ok=True)
 
     return res
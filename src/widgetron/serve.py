@@ -0,0 +1,241 @@
+"""
+`widgetron serve`: a build daemon listening on a Unix socket.
+
+Keeping one process alive between builds keeps the repodata index, the
+compiled templates and the imported build machinery warm. The protocol is
+newline delimited JSON: a client sends one request
+
+    {"directory": "/path/to/project", "config": {...}}
+
+and receives events until the build has finished
+
+    {"event": "queued", "id": "..."}
+    {"event": "started"}
+    {"event": "log", "line": "..."}
+    {"event": "done", "returncode": 0, "result": {...}}
+
+Identical requests received while a build is queued or running share it,
+other builds using the same work directory (`temp_dir`) wait for it.
+"""
+import argparse
+import contextvars
+import io
+import json
+import os
+import socket
+import socketserver
+import sys
+import threading
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import asdict
+from pathlib import Path
+from typing import Iterator
+
+from .api import build
+from .constants import CACHE_DIR
+from .utils.cache import digest
+
+if not hasattr(socket, "AF_UNIX"):
+    raise ImportError("widgetron serve requires Unix domain sockets")
+
+SOCKET = CACHE_DIR / "serve.sock"
+
+# Where the output of the build running in the current context goes
+_OUTPUT = contextvars.ContextVar("widgetron_output", default=None)
+
+
+class _ContextStdout(io.TextIOBase):
+    """Sends what builds print to their own clients."""
+
+    def __init__(self, default):
+        self.default = default
+
+    def write(self, text):
+        output = _OUTPUT.get()
+        if output is None:
+            return self.default.write(text)
+        output(text)
+        return len(text)
+
+    def flush(self):
+        self.default.flush()
+
+
+class Job:
+    def __init__(self, key: str):
+        self.key = key
+        self.events = []  # Replayed to clients joining late
+        self.finished = False
+        self._partial = ""
+        self._cond = threading.Condition()
+
+    def emit(self, **event):
+        with self._cond:
+            self.events.append(event)
+            self._cond.notify_all()
+
+    def write(self, text: str):
+        """Turn (possibly partial) output into log events, one per line."""
+        with self._cond:
+            lines = (self._partial + text).split("\n")
+            self._partial = lines.pop()
+        for line in lines:
+            self.emit(event="log", line=line)
+
+    def finish(self, **event):
+        if self._partial:
+            self.write("\n")
+        with self._cond:
+            self.events.append(dict(event="done", **event))
+            self.finished = True
+            self._cond.notify_all()
+
+    def follow(self) -> Iterator[dict]:
+        i = 0
+        while True:
+            with self._cond:
+                self._cond.wait_for(lambda: i < len(self.events) or self.finished)
+                events = self.events[i:]
+                finished = self.finished
+            yield from events
+            i += len(events)
+            if finished and i == len(self.events):
+                return
+
+
+class BuildServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, path: Path, max_jobs: int):
+        self.pool = ThreadPoolExecutor(max_workers=max_jobs)
+        self.jobs: dict[str, Job] = {}
+        self.lock = threading.Lock()
+        # Builds sharing a work directory must not run at the same time
+        self.work_dirs: dict[str, threading.Lock] = {}
+        super().__init__(str(path), RequestHandler)
+
+    def submit(self, request: dict) -> Job:
+        key = digest(json.dumps(request, sort_keys=True))
+        with self.lock:
+            job = self.jobs.get(key)
+            if job is None:
+                job = self.jobs[key] = Job(key)
+                job.emit(event="queued", id=key)
+                ctx = contextvars.copy_context()
+                self.pool.submit(ctx.run, self._build, job, request)
+            return job
+
+    def work_dir_lock(self, request: dict) -> tuple[str, threading.Lock]:
+        from .parse_args import config
+
+        directory = request["directory"]
+        options = dict(request.get("config") or {}, directory=directory)
+        try:
+            work_dir = str(config([], options, cwd=directory)["temp_dir"])
+        except Exception:  # The build itself reports bad options
+            work_dir = directory
+        with self.lock:
+            return work_dir, self.work_dirs.setdefault(work_dir, threading.Lock())
+
+    def _build(self, job: Job, request: dict):
+        _OUTPUT.set(job.write)
+        directory = Path(request["directory"])
+        try:
+            work_dir, lock = self.work_dir_lock(request)
+            if not lock.acquire(blocking=False):
+                job.write(f"Waiting for another build in {work_dir}\n")
+                lock.acquire()
+            try:
+                job.emit(event="started")
+                result = build(
+                    request.get("config") or {},
+                    cwd=directory,
+                    output=job.write,
+                    directory=str(directory),
+                )
+            finally:
+                lock.release()
+            job.finish(returncode=result.returncode, result=asdict(result))
+        except BaseException as e:
+            job.write(traceback.format_exc())
+            job.finish(returncode=1, error=str(e))
+        finally:
+            with self.lock:
+                self.jobs.pop(job.key, None)
+
+
+class RequestHandler(socketserver.StreamRequestHandler):
+    def send(self, event: dict):
+        self.wfile.write((json.dumps(event, default=str) + "\n").encode())
+        self.wfile.flush()
+
+    def handle(self):
+        try:
+            request = json.loads(self.rfile.readline())
+            request["directory"] = str(Path(request["directory"]).resolve())
+        except (ValueError, KeyError, TypeError) as e:
+            self.send(dict(event="done", returncode=1, error=f"Bad request: {e}"))
+            return
+        try:
+            for event in self.server.submit(request).follow():
+                self.send(event)
+        except (BrokenPipeError, ConnectionResetError):
+            pass  # The build carries on without this client
+
+
+def submit(
+    directory: Path | str, config: dict | None = None, path: Path | str = SOCKET
+) -> Iterator[dict]:
+    """Send a build request to a running `widgetron serve` and yield its events."""
+    request = dict(directory=str(Path(directory).resolve()), config=config or {})
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as s:
+        s.connect(str(path))
+        s.sendall((json.dumps(request) + "\n").encode())
+        with s.makefile("r") as f:
+            for line in f:
+                yield json.loads(line)
+
+
+def _in_use(path: Path) -> bool:
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as s:
+        try:
+            s.connect(str(path))
+        except OSError:
+            return False
+    return True
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(
+        prog="widgetron serve",
+        description="Run builds sent over a Unix socket in one warm process.",
+    )
+    parser.add_argument("--socket", default=str(SOCKET), help="Socket to listen on.")
+    parser.add_argument(
+        "--max_jobs",
+        type=int,
+        default=max(1, (os.cpu_count() or 2) // 2),
+        help="How many builds may run at the same time.",
+    )
+    args = parser.parse_args(argv)
+
+    path = Path(args.socket)
+    if path.exists():
+        if _in_use(path):
+            print(f"widgetron serve is already listening on {path}")
+            return 1
+        path.unlink()  # Left behind by a daemon that did not shut down cleanly
+    path.parent.mkdir(parents=True, exist_ok=True)
+
+    sys.stdout = _ContextStdout(sys.stdout)
+    with BuildServer(path, args.max_jobs) as server:
+        print(f"Listening on {path} ({args.max_jobs} concurrent builds)")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.pool.shutdown(wait=False, cancel_futures=True)
+            path.unlink(missing_ok=True)
+    return 0
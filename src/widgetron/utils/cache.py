@@ -0,0 +1,65 @@
+import hashlib
+import shutil
+import uuid
+from pathlib import Path
+
+from .shell import SHELL
+
+
+def digest(*parts) -> str:
+    """
+    sha256 over an ordered sequence of parts. Paths are hashed by content,
+    everything else by its string representation.
+    """
+    h = hashlib.sha256()
+    for part in parts:
+        if isinstance(part, Path):
+            data = part.read_bytes()
+        elif isinstance(part, bytes):
+            data = part
+        else:
+            data = str(part).encode()
+        h.update(hashlib.sha256(data).digest())
+    return h.hexdigest()
+
+
+class BuildCache:
+    """
+    Content-addressed store for build artifacts that persists between runs.
+    Entries live in `{root}/{kind}/{key}/` and are never modified once written.
+    """
+
+    def __init__(self, root: Path | str, enabled=True):
+        self.root = Path(root).expanduser().resolve()
+        self.enabled = enabled
+
+    def entry(self, kind: str, key: str) -> Path:
+        return self.root / kind / key
+
+    def get(self, kind: str, key: str) -> Path | None:
+        if not self.enabled:
+            return None
+        p = self.entry(kind, key)
+        return p if p.is_dir() else None
+
+    def put(self, kind: str, key: str, files: list[Path]) -> Path | None:
+        if not self.enabled:
+            return None
+        dst = self.entry(kind, key)
+        if dst.is_dir():
+            return dst
+        # Write to a scratch directory first so that a partially written entry
+        # is never visible to a concurrent build.
+        tmp = dst.parent / f".{key}.{uuid.uuid4().hex}"
+        tmp.mkdir(parents=True)
+        try:
+            for f in files:
+                SHELL.stage(f, tmp / Path(f).name)
+            tmp.rename(dst)
+        except OSError:
+            if not dst.is_dir():
+                raise
+        finally:
+            if tmp.exists():
+                shutil.rmtree(tmp)
+        return dst
@@ -1,4 +1,8 @@
+import hashlib
 import json
+import re
+import shutil
+import tempfile
 from pathlib import Path
 from urllib.parse import unquote, urlparse
 import sys
@@ -6,7 +10,9 @@ from warnings import warn
 
 import yaml
 
-from ..constants import CONDA, WIN, JAKE
+from ..constants import CONDA, CONDA_LOCK, SUBDIR, WIN, JAKE
+from .cache import BuildCache, digest
+from .repodata import INDEX
 from .shell import SHELL
 
 
@@ -64,12 +70,78 @@ def uninstall_widgetron(env: str | Path):
         print("Found existing install of widgetron_app... Removing")
         print(metadata)
         for pkg_file in metadata["files"]:
+            if pkg_file.endswith("widgetron_app/extract.py"):
+                remove_extracted_ui(prefix / Path(pkg_file).parent)
             print(f"Deleting: {pkg_file}")
             pkg_file = prefix / pkg_file
-            pkg_file.unlink()
+            # The UI zip is removed by the post-link script once unpacked
+            pkg_file.unlink(missing_ok=True)
         metafile.unlink()
 
 
+def remove_extracted_ui(package_dir: Path):
+    """
+    Remove the UI unpacked at install time (see widgetron_app/extract.py),
+    which is not part of the package's files.
+    """
+    info_file = package_dir / "ui.json"
+    try:
+        info = json.loads(info_file.read_text())
+    except (OSError, ValueError):
+        return
+    unpacked = info.get("unpacked") or [Path(info["ui"]).parts[0]]
+    for name in unpacked:
+        if name in ("", ".", "..") or "/" in name or "\\" in name:
+            continue  # Never outside of (or all of) the package
+        p = package_dir / name
+        print(f"Deleting: {p}")
+        if p.is_dir() and not p.is_symlink():
+            shutil.rmtree(p)
+        else:
+            p.unlink(missing_ok=True)
+    info_file.unlink()
+
+
+def installed_record(env: str | Path, package: str) -> Path | None:
+    """The conda-meta entry of `package` in `env`, if it is installed."""
+    for metafile in (Path(env) / "conda-meta").glob(f"{package}-*.json"):
+        if json.loads(metafile.read_text()).get("name") == package:
+            return metafile
+    return None
+
+
+def update_installed_files(metafile: Path, prefix: Path, changed: list[str]):
+    """
+    Record files that were added to, modified in or removed from an installed
+    package (`changed`: paths relative to `prefix`) in its conda-meta entry,
+    so that conda, and `uninstall_widgetron`, still know what it owns.
+    """
+    metadata = json.loads(metafile.read_text())
+    files = set(metadata.get("files", []))
+    paths_data = metadata.get("paths_data", {})
+    paths = {p["_path"]: p for p in paths_data.get("paths", [])}
+    for rel in changed:
+        p = prefix / rel
+        if not p.is_file():
+            files.discard(rel)
+            paths.pop(rel, None)
+            continue
+        sha = hashlib.sha256(p.read_bytes()).hexdigest()
+        files.add(rel)
+        paths[rel] = dict(
+            paths.get(rel, {"_path": rel, "path_type": "hardlink"}),
+            sha256=sha,
+            sha256_in_prefix=sha,
+            size_in_bytes=p.stat().st_size,
+        )
+    metadata["files"] = sorted(files)
+    if paths_data:
+        paths_data["paths"] = [paths[k] for k in sorted(paths)]
+    tmp = metafile.with_suffix(".tmp")
+    tmp.write_text(json.dumps(metadata, indent=2))
+    tmp.replace(metafile)
+
+
 def is_local_channel(x: str | Path) -> bool:
     if str(x).startswith("file:"):
         return True
@@ -117,8 +189,10 @@ def add_package_to_yaml(
 ) -> str:
     filename = Path(filename)
     package = f"{channel}::{package}"
-    if "version" in package_attrs:
-        package = f"{package} {package_attrs['version']}"
+    if "version" in package_attrs or "build" in package_attrs:
+        package = f"{package} {package_attrs.get('version', '*')}"
+    if "build" in package_attrs:
+        package = f"{package} {package_attrs['build']}"
     data = yaml.safe_load(filename.read_text())
     if package not in data["dependencies"]:
         data["dependencies"].append(package)
@@ -154,7 +228,10 @@ def find_env(env: str) -> str:
 
 def explicit_url(package: str, channel: str, with_hash=True, **package_attrs):
     """
-    package_attrs:
+    Url of the newest build of `package` in `channel`, looked up in the
+    in-process repodata index.
+
+    package_attrs (record fields that must match exactly):
         'arch',
         'build',
         'build_number',
@@ -174,13 +251,12 @@ def explicit_url(package: str, channel: str, with_hash=True, **package_attrs):
         'url',
         'version'
     """
-    info = json.loads(
-        SHELL.check_output([CONDA, "search", "-c", channel, package, "--json"])
-    )
-    if package_attrs:
-        for k, v in package_attrs.items():
-            info["package"] = [x for x in info["package"] if x[k] == v]
-    pkg = info[package][0]
+    matches = INDEX.search(package, channel, **package_attrs)
+    if not matches:
+        raise ValueError(
+            f"No package named '{package}' matching {package_attrs} found in {channel}"
+        )
+    pkg = matches[0]
     if with_hash:
         return f"{pkg['url']}#{pkg['md5']}"
     return pkg["url"]
@@ -201,3 +277,70 @@ def create_sbom(lock_file: str | Path, out_file: str | Path):
             "CONDA",
         ]
     )
+
+
+def spec_name(spec: str) -> str:
+    """'conda-forge::numpy >=1.20' -> 'numpy'"""
+    return re.split(r"[\s=<>!~\[]", spec.split("::")[-1].strip(), 1)[0].lower()
+
+
+def normalize_specs(specs: list[str], python_version: str) -> list[str]:
+    specs = {" ".join(x.split()) for x in specs if isinstance(x, str)}
+    if not any(spec_name(x) == "python" for x in specs):
+        specs.add(f"python {python_version}.*")
+    return sorted(specs)
+
+
+def solve_explicit(
+    specs: list[str],
+    channels: list[str],
+    python_version: str,
+    lockfile: Path,
+    cache: BuildCache,
+) -> int:
+    """
+    Solve `specs` for the current platform and write the result to `lockfile`
+    as an @EXPLICIT lock. Solutions are cached by their inputs, so an
+    unchanged environment is only ever solved once.
+    """
+    specs = normalize_specs(specs, python_version)
+    channels = list(channels)
+    key = digest("\n".join(specs), "\n".join(channels), SUBDIR, python_version)
+    lockfile = Path(lockfile)
+    lockfile.parent.mkdir(parents=True, exist_ok=True)
+
+    hit = cache.get("lock", key)
+    if hit:
+        print(f"Using cached environment solution ({key[:12]})")
+        SHELL.copy(hit / "explicit.lock", lockfile)
+        return 0
+
+    with tempfile.TemporaryDirectory() as tmp:
+        env_file = Path(tmp) / "environment.yml"
+        env_file.write_text(
+            yaml.safe_dump(
+                dict(channels=channels, dependencies=specs, platforms=[SUBDIR])
+            )
+        )
+        rc = SHELL.call(
+            [
+                CONDA_LOCK,
+                "lock",
+                "--kind",
+                "explicit",
+                "--file",
+                str(env_file),
+                "--platform",
+                SUBDIR,
+                "--filename-template",
+                str(Path(tmp) / "explicit-{platform}.lock"),
+            ],
+            cwd=tmp,
+        )
+        if rc or SHELL.mock:
+            return rc
+        solved = Path(tmp) / "explicit.lock"
+        (Path(tmp) / f"explicit-{SUBDIR}.lock").rename(solved)
+        SHELL.copy(solved, lockfile)
+        cache.put("lock", key, [solved])
+    return 0
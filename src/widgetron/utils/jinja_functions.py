@@ -1,11 +1,13 @@
 from pathlib import Path
 
-from jinja2 import Environment, FileSystemLoader
+from jinja2 import Environment, FileSystemBytecodeCache, FileSystemLoader
 
 from ..utils.shell import SHELL
 
 WIDGETRON_SRC = Path(__file__).parent.parent
 TEMPLATES = WIDGETRON_SRC / "templates"
+# Replaced by the app's own license_file, if any
+LICENSE_TEMPLATE = "server/LICENSE.txt_template"
 COMMON_ARGS = dict(
     autoescape=False,
     loader=FileSystemLoader(str(TEMPLATES)),
@@ -21,6 +23,14 @@ RECIPE_ENVIRONMENT = Environment(
 )
 
 
+def use_bytecode_cache(directory: Path):
+    """Persist compiled templates in `directory` between runs."""
+    directory.mkdir(parents=True, exist_ok=True)
+    bcc = FileSystemBytecodeCache(str(directory))
+    TEMPLATE_ENVIRONMENT.bytecode_cache = bcc
+    RECIPE_ENVIRONMENT.bytecode_cache = bcc
+
+
 def _render(template_path, **kwargs):
     """
     template_path: path to template (relative to templates folder)
@@ -32,26 +42,44 @@ def _render(template_path, **kwargs):
     return template.render(**kwargs)
 
 
-def render_templates(**kwargs):
+def rendered_files(subdir: str) -> list[Path]:
+    """
+    Paths (relative to the output folder) of every file rendered from the
+    templates in `subdir`.
+    """
+    files = []
+    for f in sorted((TEMPLATES / subdir).rglob("*_template")):
+        p = f.relative_to(TEMPLATES)
+        files.append(p.with_suffix(p.suffix.replace("_template", "")))
+    return files
+
+
+def render_templates(**kwargs) -> list[Path]:
     """
     Renders all templates, replacing all instances of {{kw}} with the value
     provided in kwargs.
+
+    Files whose content would not change are left untouched (mtime included).
+    Returns the paths (relative to the output folder) that were written.
     """
     outdir = kwargs["temp_dir"]
     outdir.mkdir(exist_ok=True)
+    changed = []
     for f in TEMPLATES.rglob("*_template"):
         rel = f.relative_to(TEMPLATES)
-        intermediate_folders = rel.parts[:-1]
-
-        # Create sub-directories in output folder
-        for i in range(len(intermediate_folders)):
-            subdir = "/".join(intermediate_folders[: i + 1])
-            (outdir / subdir).mkdir(exist_ok=True)
-
+        if kwargs.get("license_file") and rel.as_posix() == LICENSE_TEMPLATE:
+            continue  # copy_notebook puts the app's own license there
         p: Path = outdir / rel
+        p.parent.mkdir(parents=True, exist_ok=True)
+
         if p.suffix.endswith("_template"):
             p = p.with_suffix(p.suffix.replace("_template", ""))
+            content = _render("/".join(rel.parts), **kwargs)
+            if p.is_file() and p.read_text() == content:
+                continue
             with open(p, "w") as f:
-                f.write(_render("/".join(rel.parts), **kwargs))
+                f.write(content)
         else:
             SHELL.copy(TEMPLATES / "/".join(rel.parts), str(p))
+        changed.append(p.relative_to(outdir))
+    return changed
@@ -0,0 +1,317 @@
+import hashlib
+import importlib.util
+import io
+import json
+import os
+import py_compile
+import tarfile
+import tempfile
+import time
+import zipfile
+from contextlib import contextmanager
+from pathlib import Path
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+from ..constants import SUBDIR, WIN
+from .shell import SHELL
+
+IGNORE = ("__pycache__", ".ipynb_checkpoints")
+
+
+def site_packages(python_version: str) -> str:
+    if WIN:
+        return "Lib/site-packages"
+    return f"lib/python{python_version}/site-packages"
+
+
+def collect_files(src: Path, prefix: str, exclude=()) -> dict[str, Path]:
+    """
+    Map install paths (relative to the env prefix) to files under `src`.
+    `exclude` lists top-level entries of `src` to leave out.
+    """
+    src = Path(src)
+    files = {}
+    for p in sorted(src.rglob("*")):
+        parts = p.relative_to(src).parts
+        if p.is_dir() or parts[0] in exclude or any(x in IGNORE for x in parts):
+            continue
+        files[f"{prefix}/{p.relative_to(src).as_posix()}"] = p
+    return files
+
+
+def compile_bytecode(
+    files: dict[str, Path], out_dir: Path, optimize=0, invalidation_mode="checked-hash"
+) -> dict[str, Path]:
+    """
+    Compile the .py files in `files` (as returned by `collect_files`) with the
+    running interpreter and return the matching __pycache__ entries.
+    Installed files do not keep their build-time mtime, so timestamp based
+    pycs would be stale; a hash based mode is always used instead.
+    """
+    if invalidation_mode == "timestamp":
+        invalidation_mode = "checked-hash"
+    mode = py_compile.PycInvalidationMode[invalidation_mode.upper().replace("-", "_")]
+    compiled = {}
+    if SHELL.mock:
+        return compiled  # Nothing is written, so there is nothing to package
+    for target, src in files.items():
+        if not target.endswith(".py"):
+            continue
+        pyc = importlib.util.cache_from_source(
+            target, optimization=optimize or ""
+        ).replace(os.sep, "/")
+        dst = Path(out_dir) / pyc
+        dst.parent.mkdir(parents=True, exist_ok=True)
+        py_compile.compile(
+            str(src),
+            cfile=str(dst),
+            dfile=target,
+            doraise=True,
+            optimize=optimize,
+            invalidation_mode=mode,
+        )
+        compiled[pyc] = dst
+    return compiled
+
+
+def _sha256(p: Path) -> str:
+    h = hashlib.sha256()
+    with open(p, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def _tarinfo(name: str, size: int, mode=0o644) -> tarfile.TarInfo:
+    info = tarfile.TarInfo(name)
+    info.size = size
+    info.mode = mode
+    info.mtime = 0  # Reproducible archives
+    return info
+
+
+def _write_tar(fileobj, info_files: dict[str, bytes], files: dict[str, Path], mode):
+    with tarfile.open(fileobj=fileobj, mode=mode) as tar:
+        for name, data in info_files.items():
+            tar.addfile(_tarinfo(name, len(data)), io.BytesIO(data))
+        for name, p in files.items():
+            st = p.stat()
+            with open(p, "rb") as f:
+                tar.addfile(_tarinfo(name, st.st_size, st.st_mode & 0o777), f)
+
+
+def _write_tar_bz2(path: Path, info_files, files):
+    with open(path, "wb") as f:
+        _write_tar(f, info_files, files, "w:bz2")
+
+
+def _write_conda(path: Path, stem: str, info_files, files):
+    # https://docs.conda.io/projects/conda-build/en/stable/resources/package-spec.html
+    cctx = zstandard.ZstdCompressor(level=3)
+    with zipfile.ZipFile(path, "w", zipfile.ZIP_STORED) as z:
+        z.writestr("metadata.json", json.dumps({"conda_pkg_format_version": 2}))
+        for component, (i, f) in {
+            "pkg": ({}, files),
+            "info": (info_files, {}),
+        }.items():
+            with tempfile.TemporaryFile() as tmp:
+                with cctx.stream_writer(tmp, closefd=False) as zst:
+                    _write_tar(zst, i, f, "w|")
+                tmp.seek(0)
+                with z.open(f"{component}-{stem}.tar.zst", "w", force_zip64=True) as out:
+                    for chunk in iter(lambda: tmp.read(1 << 20), b""):
+                        out.write(chunk)
+
+
+def _try_lock(f) -> bool:
+    try:
+        if fcntl:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        else:
+            f.seek(0)  # msvcrt locks bytes from the current position
+            msvcrt.locking(f.fileno(), msvcrt.LK_NBLCK, 1)
+        return True
+    except OSError:
+        return False
+
+
+def _unlock(f):
+    if fcntl:
+        fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+    else:
+        f.seek(0)
+        msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+
+
+@contextmanager
+def file_lock(path: Path, timeout=600):
+    """
+    Cross-process lock, used to serialize updates to a channel index. The OS
+    releases it if its owner dies, so a killed build never blocks others.
+    """
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    deadline = time.monotonic() + timeout
+    with open(path, "a+b") as f:
+        while not _try_lock(f):
+            if time.monotonic() > deadline:
+                raise TimeoutError(f"Could not acquire {path}")
+            time.sleep(0.05)
+        try:
+            yield
+        finally:
+            _unlock(f)
+
+
+def _update_json(path: Path, update):
+    data = json.loads(path.read_text()) if path.is_file() else {}
+    update(data)
+    tmp = path.with_suffix(".tmp")
+    tmp.write_text(json.dumps(data, indent=2, sort_keys=True))
+    tmp.replace(path)
+
+
+def _init_repodata(subdir: str):
+    def update(repodata):
+        repodata.setdefault("info", {"subdir": subdir})
+        repodata.setdefault("packages", {})
+        repodata.setdefault("packages.conda", {})
+        repodata.setdefault("repodata_version", 1)
+
+    return update
+
+
+def _group(package: Path) -> str:
+    return "packages.conda" if package.name.endswith(".conda") else "packages"
+
+
+def index_package(channel: Path, package: Path, record: dict) -> dict:
+    """
+    Add a package to the repodata.json/channeldata.json of a local channel.
+    Returns the record as written to repodata.json.
+    """
+    channel = Path(channel)
+    subdir = record["subdir"]
+    md5, sha256 = hashlib.md5(), hashlib.sha256()
+    with open(package, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            md5.update(chunk)
+            sha256.update(chunk)
+    record = dict(
+        record,
+        md5=md5.hexdigest(),
+        sha256=sha256.hexdigest(),
+        size=package.stat().st_size,
+    )
+
+    def add_record(repodata):
+        _init_repodata(subdir)(repodata)
+        repodata[_group(package)][package.name] = record
+
+    def add_channeldata(channeldata):
+        channeldata.setdefault("channeldata_version", 1)
+        channeldata["subdirs"] = sorted({*channeldata.get("subdirs", []), subdir})
+        pkg = channeldata.setdefault("packages", {}).setdefault(record["name"], {})
+        pkg["subdirs"] = sorted({*pkg.get("subdirs", []), subdir})
+        pkg["version"] = record["version"]
+        pkg["timestamp"] = record["timestamp"]
+
+    # conda expects every channel to have a noarch subdir
+    (channel / "noarch").mkdir(parents=True, exist_ok=True)
+    with file_lock(channel / ".index.lock"):
+        _update_json(channel / "noarch" / "repodata.json", _init_repodata("noarch"))
+        _update_json(channel / subdir / "repodata.json", add_record)
+        _update_json(channel / "channeldata.json", add_channeldata)
+    return record
+
+
+def build_package(
+    name: str,
+    version: str,
+    build_prefix: str,
+    files: dict[str, Path],
+    depends: list[str],
+    output_dir: Path | str,
+) -> dict:
+    """
+    Write a conda package holding `files` (install path -> source file) to the
+    local channel `output_dir` and index it. The build string is
+    `{build_prefix}_{content hash}` (of the files, name, version and
+    depends), so an unchanged package is reused instead of being written
+    again.
+
+    Returns the package's repodata record.
+    """
+    output_dir = Path(output_dir)
+    paths = []
+    h = hashlib.sha256()
+    # The metadata is part of the package too: a package whose files are
+    # unchanged but which depends on a new build of another one is new
+    h.update(json.dumps([name, version, sorted(depends)]).encode())
+    for rel, p in files.items():
+        sha = _sha256(p)
+        size = p.stat().st_size
+        h.update(f"{rel}\0{sha}\0".encode())
+        paths.append(
+            dict(_path=rel, path_type="hardlink", sha256=sha, size_in_bytes=size)
+        )
+    build = f"{build_prefix}_{h.hexdigest()[:7]}"
+    stem = f"{name}-{version}-{build}"
+    ext = ".conda" if zstandard else ".tar.bz2"
+    dst = output_dir / SUBDIR / f"{stem}{ext}"
+
+    platform, arch = SUBDIR.split("-")
+    record = dict(
+        name=name,
+        version=version,
+        build=build,
+        build_number=0,
+        depends=list(depends),
+        arch={"64": "x86_64", "32": "x86"}.get(arch, arch),
+        platform=platform,
+        subdir=SUBDIR,
+        timestamp=int(time.time() * 1000),
+        license="",
+    )
+
+    if dst.exists():
+        print(f"{dst.name} already exists, skipping")
+        repodata = dst.parent / "repodata.json"
+        if repodata.is_file():
+            indexed = json.loads(repodata.read_text()).get(_group(dst), {}).get(dst.name)
+            if indexed:
+                return indexed
+        return index_package(output_dir, dst, record)
+
+    info_files = {
+        "info/index.json": json.dumps(record, indent=2).encode(),
+        "info/paths.json": json.dumps(
+            dict(paths=paths, paths_version=1), indent=2
+        ).encode(),
+        "info/files": "\n".join(files).encode() + b"\n",
+    }
+
+    SHELL._log(f"conda-package {dst}\n")
+    if SHELL.mock:
+        return record
+    dst.parent.mkdir(parents=True, exist_ok=True)
+    tmp = dst.with_name(f".{dst.name}.{os.getpid()}")
+    try:
+        if ext == ".conda":
+            _write_conda(tmp, stem, info_files, files)
+        else:
+            _write_tar_bz2(tmp, info_files, files)
+        tmp.replace(dst)
+    finally:
+        tmp.unlink(missing_ok=True)
+    return index_package(output_dir, dst, record)
@@ -0,0 +1,100 @@
+import contextvars
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Callable
+
+from .profile import PROFILER
+
+
+class Stage:
+    """
+    A step of the build. `inputs` and `outputs` name the artifacts a stage
+    consumes and produces; a stage runs once every stage producing one of its
+    inputs has finished. Inputs nobody produces are assumed to already exist.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        func: Callable[[dict], int | None],
+        inputs: list[str] = (),
+        outputs: list[str] = (),
+    ):
+        self.name = name
+        self.func = func
+        self.inputs = tuple(inputs)
+        self.outputs = tuple(outputs)
+
+    def __call__(self, kwargs) -> int:
+        with PROFILER.span(self.name, "stage"):
+            return self.func(kwargs) or 0
+
+    def __repr__(self):
+        return f"Stage({self.name!r}, inputs={self.inputs}, outputs={self.outputs})"
+
+
+class Pipeline:
+    def __init__(self, stages: list[Stage]):
+        self.stages = {s.name: s for s in stages}
+        producers = {}
+        for s in stages:
+            for artifact in s.outputs:
+                assert (
+                    artifact not in producers
+                ), f"'{artifact}' is produced by both '{producers[artifact]}' and '{s.name}'"
+                producers[artifact] = s.name
+        self.deps = {
+            s.name: {producers[x] for x in s.inputs if x in producers} for s in stages
+        }
+        self.order()  # Fail early on cycles
+
+    def order(self) -> list[str]:
+        """Stage names in an order that satisfies every dependency."""
+        done = []
+        remaining = dict(self.deps)
+        while remaining:
+            ready = [k for k, v in remaining.items() if v <= set(done)]
+            assert ready, f"Dependency cycle between stages {list(remaining)}"
+            for k in ready:
+                done.append(k)
+                remaining.pop(k)
+        return done
+
+    def only(self, names: list[str]) -> "Pipeline":
+        """The named stages (if present) and every stage they depend on."""
+        keep = set()
+        todo = [n for n in names if n in self.stages]
+        while todo:
+            name = todo.pop()
+            if name not in keep:
+                keep.add(name)
+                todo += self.deps[name]
+        return Pipeline([s for n, s in self.stages.items() if n in keep])
+
+    def run(self, kwargs, jobs: int = 1) -> int:
+        """
+        Run every stage, at most `jobs` at a time. Returns the first non-zero
+        return code; no new stages are started after a failure.
+        """
+        jobs = max(1, jobs)
+        pending = self.order()
+        done = set()
+        running = {}
+        rc = 0
+        with ThreadPoolExecutor(max_workers=jobs) as pool:
+            while pending or running:
+                for name in list(pending):
+                    if rc or len(running) >= jobs:
+                        break
+                    if self.deps[name] <= done:
+                        pending.remove(name)
+                        # Stages see the context (e.g. SHELL) of the build
+                        ctx = contextvars.copy_context()
+                        future = pool.submit(ctx.run, self.stages[name], kwargs)
+                        running[future] = name
+                if not running:
+                    break
+                finished, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    done.add(running.pop(future))
+                    rc = rc or future.result()
+        return rc
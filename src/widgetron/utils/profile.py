@@ -0,0 +1,125 @@
+import contextvars
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+
+# Metrics that are rolled up from shell operations into the enclosing stage
+_SUMMED = ("cpu_s", "read_bytes", "write_bytes")
+_MAXED = ("peak_rss_bytes",)
+
+
+class Profiler:
+    """
+    Records timed spans (pipeline stages and the shell operations they run)
+    and writes them as Chrome trace events (chrome://tracing, ui.perfetto.dev).
+    """
+
+    def __init__(self, enabled=False):
+        self.enabled = enabled
+        self.events = []
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._t0 = time.perf_counter()
+
+    @contextmanager
+    def span(self, name: str, cat: str, **args):
+        """
+        Time the enclosed block. The yielded dict can be filled with metrics;
+        those listed in _SUMMED/_MAXED are added to every enclosing span.
+        """
+        if not self.enabled:
+            yield {}
+            return
+        metrics = dict(args)
+        parents = getattr(self._local, "stack", [])
+        self._local.stack = [*parents, metrics]
+        start = time.perf_counter()
+        try:
+            yield metrics
+        finally:
+            end = time.perf_counter()
+            self._local.stack = parents
+            for parent in parents:
+                for k in _SUMMED:
+                    if k in metrics:
+                        parent[k] = parent.get(k, 0) + metrics[k]
+                for k in _MAXED:
+                    if k in metrics:
+                        parent[k] = max(parent.get(k, 0), metrics[k])
+            event = dict(
+                name=name,
+                cat=cat,
+                ph="X",
+                ts=(start - self._t0) * 1e6,
+                dur=(end - start) * 1e6,
+                pid=os.getpid(),
+                tid=threading.get_ident(),
+                args=metrics,
+            )
+            with self._lock:
+                self.events.append(event)
+
+    def write_trace(self, path: Path | str):
+        Path(path).write_text(
+            json.dumps(dict(traceEvents=self.events, displayTimeUnit="ms"))
+        )
+
+    def summary(self, cat="stage") -> str:
+        events = sorted(
+            [e for e in self.events if e["cat"] == cat], key=lambda e: e["ts"]
+        )
+        mb = 1 / 2**20
+        rows = [("stage", "wall [s]", "cpu [s]", "rss [MB]", "read [MB]", "write [MB]")]
+        for e in events:
+            a = e["args"]
+            rows.append(
+                (
+                    e["name"],
+                    f"{e['dur'] / 1e6:.2f}",
+                    f"{a.get('cpu_s', 0):.2f}",
+                    f"{a.get('peak_rss_bytes', 0) * mb:.0f}",
+                    f"{a.get('read_bytes', 0) * mb:.1f}",
+                    f"{a.get('write_bytes', 0) * mb:.1f}",
+                )
+            )
+        if events:
+            wall = max(e["ts"] + e["dur"] for e in events) - min(e["ts"] for e in events)
+            rows.append(("total", f"{wall / 1e6:.2f}", "", "", "", ""))
+        widths = [max(len(r[i]) for r in rows) for i in range(len(rows[0]))]
+        return "\n".join(
+            "  ".join(
+                x.ljust(w) if i == 0 else x.rjust(w)
+                for i, (x, w) in enumerate(zip(r, widths))
+            )
+            for r in rows
+        )
+
+
+class CurrentProfiler:
+    """
+    Forwards to the Profiler of the build running in the current context (see
+    `use_profiler`), so that each build records (and writes) its own trace.
+    """
+
+    def __getattr__(self, name):
+        return getattr(current_profiler(), name)
+
+
+_DEFAULT = Profiler()
+_CURRENT = contextvars.ContextVar("widgetron_profiler")
+
+
+def current_profiler() -> Profiler:
+    return _CURRENT.get(_DEFAULT)
+
+
+def use_profiler(profiler: Profiler) -> Profiler:
+    """Make `profiler` the PROFILER of the current context (e.g. a build)."""
+    _CURRENT.set(profiler)
+    return profiler
+
+
+PROFILER = CurrentProfiler()
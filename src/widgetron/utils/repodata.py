@@ -0,0 +1,201 @@
+import gzip
+import hashlib
+import json
+import os
+import re
+import sys
+import threading
+from pathlib import Path
+from urllib.error import HTTPError, URLError
+from urllib.parse import unquote, urlparse
+from urllib.request import Request, urlopen
+from warnings import warn
+
+from ..constants import SUBDIR
+
+ANACONDA = "https://conda.anaconda.org"
+DEFAULTS = "https://repo.anaconda.com/pkgs/main"
+
+
+def channel_url(channel: str | Path) -> str:
+    """Normalize a channel name, path or url to a url without trailing slash."""
+    channel = str(channel)
+    if channel == "local":
+        return (Path(sys.prefix) / "conda-bld").as_uri()
+    if "://" in channel:
+        return channel.rstrip("/")
+    if channel in ("defaults", "main"):
+        return DEFAULTS
+    if Path(channel).exists():
+        return Path(channel).resolve().as_uri()
+    return f"{ANACONDA}/{channel.strip('/')}"
+
+
+def url_to_path(url: str) -> Path:
+    p = unquote(urlparse(url).path)
+    if re.match(r"^/[a-zA-Z]:", p):  # file:///C:/...
+        p = p[1:]
+    return Path(p)
+
+
+def version_key(version: str) -> tuple:
+    # Rough approximation of conda's VersionOrder: numbers compare as numbers,
+    # and letters (pre-releases) sort before numbers.
+    return tuple(
+        (1, int(x)) if x.isdigit() else (0, x.lower())
+        for x in re.findall(r"\d+|[a-zA-Z]+", version)
+    )
+
+
+def _newest_first(record: dict) -> tuple:
+    return (
+        version_key(record.get("version", "")),
+        record.get("build_number", 0),
+        record.get("timestamp", 0),
+    )
+
+
+class PackageIndex:
+    """
+    In-process view of the repodata of conda channels.
+
+    Each (channel, subdir) is loaded at most once per run. Remote repodata is
+    kept on disk in `cache_dir` and revalidated with its ETag/Last-Modified;
+    local (file://) channels are read straight from disk and reloaded only
+    when their repodata.json changes.
+    """
+
+    def __init__(self, cache_dir: Path | str | None = None):
+        self.cache_dir = cache_dir
+        self._lock = threading.Lock()
+        self._repodata = {}  # (url, subdir, filename) -> (stamp, records)
+        self._channeldata = {}  # url -> (stamp, channeldata)
+
+    def search(self, package: str, channel: str, **package_attrs) -> list[dict]:
+        """
+        All records named `package` in `channel` (newest first) whose fields
+        match every one of `package_attrs`.
+        """
+        url = channel_url(channel)
+        subdirs = self._subdirs_with(url, package)
+        matches = []
+        for subdir in subdirs:
+            for filename in self._repodata_files(url):
+                records = self._records(url, subdir, filename)
+                found = [
+                    r
+                    for r in records.get(package, [])
+                    if all(r.get(k) == v for k, v in package_attrs.items())
+                ]
+                if found:
+                    matches += found
+                    break
+        return sorted(matches, key=_newest_first, reverse=True)
+
+    def _repodata_files(self, url: str) -> list[str]:
+        # current_repodata.json only holds the latest version of each package
+        # and is a fraction of the size, so try it first for remote channels.
+        if url.startswith("file:"):
+            return ["repodata.json"]
+        return ["current_repodata.json", "repodata.json"]
+
+    def _subdirs_with(self, url: str, package: str) -> list[str]:
+        channeldata = self._load_channeldata(url)
+        default = [SUBDIR, "noarch"]
+        if not channeldata:
+            return default
+        info = channeldata.get("packages", {}).get(package)
+        if info is None or "subdirs" not in info:
+            return default
+        return [x for x in default if x in info["subdirs"]]
+
+    def _load_channeldata(self, url: str) -> dict:
+        with self._lock:
+            stamp, data = self._channeldata.get(url, (None, None))
+            new_stamp = self._local_stamp(url, "channeldata.json")
+            if data is not None and stamp == new_stamp:
+                return data
+            data = self._read_json(url, "channeldata.json") or {}
+            self._channeldata[url] = (new_stamp, data)
+            return data
+
+    def _records(self, url: str, subdir: str, filename: str) -> dict[str, list]:
+        key = (url, subdir, filename)
+        with self._lock:
+            stamp, records = self._repodata.get(key, (None, None))
+            new_stamp = self._local_stamp(url, f"{subdir}/{filename}")
+            if records is not None and stamp == new_stamp:
+                return records
+            repodata = self._read_json(url, f"{subdir}/{filename}") or {}
+            records = {}
+            for group in ("packages", "packages.conda"):
+                for fn, record in repodata.get(group, {}).items():
+                    record = dict(
+                        record,
+                        fn=fn,
+                        url=f"{url}/{subdir}/{fn}",
+                        channel=url,
+                        subdir=record.get("subdir", subdir),
+                    )
+                    records.setdefault(record["name"], []).append(record)
+            self._repodata[key] = (new_stamp, records)
+            return records
+
+    def _local_stamp(self, url: str, rel: str):
+        # Remote files are only fetched once per run, so they never go stale.
+        if not url.startswith("file:"):
+            return None
+        p = url_to_path(url) / rel
+        return p.stat().st_mtime_ns if p.is_file() else -1
+
+    def _read_json(self, url: str, rel: str) -> dict | None:
+        if url.startswith("file:"):
+            p = url_to_path(url) / rel
+            return json.loads(p.read_text()) if p.is_file() else None
+        return self._fetch(f"{url}/{rel}")
+
+    def _fetch(self, url: str) -> dict | None:
+        cached = meta = None
+        if self.cache_dir:
+            entry = Path(self.cache_dir) / hashlib.sha256(url.encode()).hexdigest()
+            cached, meta = entry / "data.json", entry / "meta.json"
+
+        headers = {"Accept-Encoding": "gzip"}
+        if cached and cached.is_file() and meta.is_file():
+            info = json.loads(meta.read_text())
+            if info.get("etag"):
+                headers["If-None-Match"] = info["etag"]
+            if info.get("last_modified"):
+                headers["If-Modified-Since"] = info["last_modified"]
+
+        try:
+            with urlopen(Request(url, headers=headers), timeout=60) as r:
+                body = r.read()
+                if r.headers.get("Content-Encoding") == "gzip":
+                    body = gzip.decompress(body)
+                etag = r.headers.get("ETag")
+                last_modified = r.headers.get("Last-Modified")
+        except HTTPError as e:
+            if e.code == 304:
+                return json.loads(cached.read_text())
+            if e.code == 404:
+                return None
+            raise
+        except URLError as e:
+            if cached and cached.is_file():
+                warn(f"Could not reach {url} ({e.reason}). Using cached copy.")
+                return json.loads(cached.read_text())
+            raise
+
+        if cached:
+            cached.parent.mkdir(parents=True, exist_ok=True)
+            tmp = cached.with_suffix(f".{os.getpid()}.tmp")
+            tmp.write_bytes(body)
+            tmp.replace(cached)
+            meta.write_text(
+                json.dumps(dict(url=url, etag=etag, last_modified=last_modified))
+            )
+        return json.loads(body)
+
+
+INDEX = PackageIndex()
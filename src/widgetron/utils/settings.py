@@ -3,11 +3,10 @@ from typing import List
 
 import traitlets as T
 import yaml
-from constructor.conda_interface import cc_platform
 from .shell import SHELL
 
 
-from ..constants import REQUIRED_PKGS, WIN, DEFAULT_ICON
+from ..constants import REQUIRED_PKGS, SUBDIR, WIN, DEFAULT_ICON
 from .conda import (
     add_package_to_lock,
     add_package_to_yaml,
@@ -163,7 +162,10 @@ class ConstructorSettings(T.HasTraits):
         # NOTE: It should be possible to build off of the yaml file directly
         #   but was running into issues with local channels not being handled
         #   correctly.
-        # TODO: Run conda-lock and give the lockfile to constructor
+        # The `solve_environment` build stage turns these specs into an
+        #   explicit lockfile (see `lock`) when conda-lock is available.
+        if not self.environment_yaml:
+            return
         data = yaml.safe_load(Path(self.environment_yaml).read_text())
         self.channels = data["channels"]
         self.specs = data["dependencies"]
@@ -182,7 +184,7 @@ class ConstructorSettings(T.HasTraits):
         channels = []
         for url in urls:
             if url.strip():
-                for subdir in ["noarch", cc_platform]:
+                for subdir in ["noarch", SUBDIR]:
                     if f"/{subdir}/" in url:
                         channel, package = url.split(f"/{subdir}/")
                         channels.append(channel)
@@ -191,6 +193,18 @@ class ConstructorSettings(T.HasTraits):
                     raise ValueError(f"Unexpected package url. ({url})")
         self.channels = channels
 
+    def lock(self, lockfile: Path | str):
+        """
+        Replace `specs` (from `dependencies` or `environment_yaml`) with an
+        equivalent explicit lockfile.
+        """
+        self.specs = ()
+        self.explicit_lock = str(lockfile)
+        # The lockfile supersedes the yaml file it was solved from (there is
+        # no file to validate when clearing it)
+        with self.cross_validation_lock:
+            self.environment_yaml = ""
+
     @T.validate("name")
     def _clean_name(self, proposal: T.Bunch) -> str:
         return "_".join(proposal.value.split())
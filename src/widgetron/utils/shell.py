@@ -1,26 +1,109 @@
+import contextvars
 import os
 import shutil
 import subprocess
+import sys
+import threading
 from pathlib import Path
 import zipfile
 
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+from .profile import PROFILER
+
+FICLONE = 0x40049409  # linux/fs.h
+STAGING_MODES = {
+    "auto": ["reflink", "hardlink", "copy"],
+    "reflink": ["reflink", "copy"],
+    "hardlink": ["hardlink", "copy"],
+    "copy": ["copy"],
+}
+
+
+def _reflink(src, dst):
+    if fcntl is None:
+        raise OSError("reflinks are not supported on this platform")
+    with open(src, "rb") as s, open(dst, "wb") as d:
+        fcntl.ioctl(d.fileno(), FICLONE, s.fileno())
+
 
 class Shell:
-    def __init__(self, mock=False, log=None):
+    def __init__(self, mock=False, log=None, staging="auto", output=None):
+        self._lock = threading.Lock()
+        self._log_file = None
         self.log = log
         self.mock = mock
+        self.staging = staging
+        # If set, called with each line printed by `call`ed commands instead
+        # of letting them write to the terminal
+        self.output = output
+
+    @property
+    def log(self):
+        return self._log_path
+
+    @log.setter
+    def log(self, value):
+        with self._lock:
+            if self._log_file:
+                self._log_file.close()
+            self._log_file = None
+            self._log_path = value
 
     def _log(self, msg):
         if self.log:
-            with self.log.open(mode="a") as f:
-                f.write(msg)
+            with self._lock:
+                if self._log_file is None:
+                    self._log_file = Path(self.log).open(mode="a")
+                self._log_file.write(msg)
+                self._log_file.flush()
+
+    def _run(self, cmd, output=None, **kw) -> tuple[int, bytes | str | None]:
+        name = Path(str(cmd[0])).name
+        with PROFILER.span(name, "shell", cmd=" ".join(map(str, cmd))) as metrics:
+            with subprocess.Popen(cmd, **kw) as proc:
+                out = None
+                if output is not None:
+                    for line in proc.stdout:
+                        if isinstance(line, bytes):
+                            line = line.decode(errors="replace")
+                        output(line)
+                if not (PROFILER.enabled and hasattr(os, "wait4")):
+                    if output is None:
+                        out, _ = proc.communicate()
+                    else:
+                        proc.wait()
+                    return proc.returncode, out
+                # wait4 reports the resources used by the child (and the
+                # descendants it waited for), which Popen.wait discards.
+                if output is None and proc.stdout:
+                    out = proc.stdout.read()
+                _, status, usage = os.wait4(proc.pid, 0)
+                proc.returncode = os.waitstatus_to_exitcode(status)
+            rss_unit = 1 if sys.platform == "darwin" else 1024
+            metrics.update(
+                cpu_s=usage.ru_utime + usage.ru_stime,
+                peak_rss_bytes=usage.ru_maxrss * rss_unit,
+                read_bytes=usage.ru_inblock * 512,
+                write_bytes=usage.ru_oublock * 512,
+            )
+            return proc.returncode, out
 
     def call(self, cmd, **kw) -> int:
         self._log(" ".join([str(x) for x in cmd]) + "\n")
         for k, v in kw.items():
             self._log(f"  {k}: {v}\n")
         if not self.mock:
-            return subprocess.call(cmd, **kw)
+            if self.output is not None and "stdout" not in kw:
+                kw.update(
+                    stdout=subprocess.PIPE,
+                    stderr=subprocess.STDOUT,
+                    output=self.output,
+                )
+            return self._run(cmd, **kw)[0]
         return 0
 
     def check_output(self, cmd, **kw) -> str:
@@ -28,7 +111,10 @@ class Shell:
         for k, v in kw.items():
             self._log(f"  {k}: {v}\n")
         if not self.mock:
-            return subprocess.check_output(cmd, **kw)
+            rc, out = self._run(cmd, stdout=subprocess.PIPE, **kw)
+            if rc:
+                raise subprocess.CalledProcessError(rc, cmd, out)
+            return out
         return ""
 
     def copy(self, src, dst, **kw):
@@ -36,7 +122,55 @@ class Shell:
         for k, v in kw.items():
             self._log(f"  {k}: {v}\n")
         if not self.mock:
-            shutil.copyfile(src=str(src), dst=str(dst), **kw)
+            size = Path(src).stat().st_size
+            with PROFILER.span("copy", "shell", src=str(src)) as metrics:
+                shutil.copyfile(src=str(src), dst=str(dst), **kw)
+                metrics.update(read_bytes=size, write_bytes=size)
+
+    def stage(self, src, dst, read_only=False) -> str:
+        """
+        Put the content of `src` at `dst` as cheaply as `self.staging` allows:
+        a reflink (copy-on-write clone), then a hardlink, then a plain copy.
+        Hardlinks share the file with `src`, so they are only used when the
+        caller promises never to modify `dst` in place (`read_only`).
+        Returns the strategy that was used.
+        """
+        modes = [
+            m for m in STAGING_MODES[self.staging] if read_only or m != "hardlink"
+        ]
+        if self.mock:
+            self._log(f"stage[{modes[0]}] {src} {dst}\n")
+            return modes[0]
+        Path(dst).unlink(missing_ok=True)
+        with PROFILER.span("stage", "shell", src=str(src)) as metrics:
+            for mode in modes:
+                try:
+                    if mode == "reflink":
+                        _reflink(src, dst)
+                    elif mode == "hardlink":
+                        os.link(src, dst)
+                    else:
+                        shutil.copyfile(src=str(src), dst=str(dst))
+                        size = Path(src).stat().st_size
+                        metrics.update(read_bytes=size, write_bytes=size)
+                    break
+                except OSError:
+                    Path(dst).unlink(missing_ok=True)
+                    if mode == "copy":
+                        raise
+            metrics["mode"] = mode
+        self._log(f"stage[{mode}] {src} {dst}\n")
+        return mode
+
+    def detach(self, path):
+        """Give a hardlinked file its own copy so it can be modified in place."""
+        path = Path(path)
+        if self.mock or path.stat().st_nlink < 2:
+            return
+        self._log(f"detach {path}\n")
+        tmp = path.with_name(f".{path.name}.detach")
+        shutil.copy2(path, tmp)
+        tmp.replace(path)
 
     def copytree(self, src, dst, **kw):
         self._log(f"cp -r {src} {dst}\n")
@@ -52,6 +186,11 @@ class Shell:
         if not self.mock:
             shutil.move(src=str(src), dst=str(dst), **kw)
 
+    def remove(self, path):
+        self._log(f"rm {path}\n")
+        if not self.mock:
+            Path(path).unlink(missing_ok=True)
+
     def cd(self, dir):
         self._log(f"cd {dir}\n")
         if not self.mock:
@@ -60,16 +199,47 @@ class Shell:
     def zipdir(self, src, dst):
         self._log(f"zip {src} {dst}\n")
         if not self.mock:
-            with zipfile.ZipFile(dst, "w", zipfile.ZIP_DEFLATED) as ziph:
-                # ziph is zipfile handle
-                for root, dirs, files in os.walk(src):
-                    for file in files:
-                        ziph.write(
-                            os.path.join(root, file),
-                            os.path.relpath(
-                                os.path.join(root, file), os.path.join(src, "..")
-                            ),
-                        )
-
-
-SHELL = Shell()
+            with PROFILER.span("zip", "shell", src=str(src)) as metrics:
+                read = 0
+                with zipfile.ZipFile(dst, "w", zipfile.ZIP_DEFLATED) as ziph:
+                    # ziph is zipfile handle
+                    for root, dirs, files in os.walk(src):
+                        for file in files:
+                            ziph.write(
+                                os.path.join(root, file),
+                                os.path.relpath(
+                                    os.path.join(root, file), os.path.join(src, "..")
+                                ),
+                            )
+                            read += os.path.getsize(os.path.join(root, file))
+                metrics.update(read_bytes=read, write_bytes=Path(dst).stat().st_size)
+
+class CurrentShell:
+    """
+    Forwards to the Shell of the build running in the current context (see
+    `use_shell`), so that concurrent builds in one process do not share
+    their mock/log/staging settings.
+    """
+
+    def __getattr__(self, name):
+        return getattr(current_shell(), name)
+
+    def __setattr__(self, name, value):
+        setattr(current_shell(), name, value)
+
+
+_DEFAULT = Shell()
+_CURRENT = contextvars.ContextVar("widgetron_shell")
+
+
+def current_shell() -> Shell:
+    return _CURRENT.get(_DEFAULT)
+
+
+def use_shell(shell: Shell) -> Shell:
+    """Make `shell` the SHELL of the current context (e.g. a build)."""
+    _CURRENT.set(shell)
+    return shell
+
+
+SHELL = CurrentShell()
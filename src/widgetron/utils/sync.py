@@ -0,0 +1,114 @@
+import hashlib
+import json
+import os
+from fnmatch import fnmatch
+from pathlib import Path
+
+from .shell import SHELL
+
+
+def _sha256(p: Path) -> str:
+    h = hashlib.sha256()
+    with open(p, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def walk_tree(src: Path, ignore=(), include=(), exclude=()):
+    """Paths (relative to `src`) of the files `sync_tree` would copy."""
+    for root, dirs, files in os.walk(src):
+        dirs[:] = [d for d in dirs if not any(fnmatch(d, x) for x in ignore)]
+        for name in files:
+            if any(fnmatch(name, x) for x in ignore):
+                continue
+            rel = (Path(root) / name).relative_to(src).as_posix()
+            if include and not any(fnmatch(rel, x) for x in include):
+                continue
+            if any(fnmatch(rel, x) for x in exclude):
+                continue
+            yield rel
+
+
+def sync_tree(
+    src: Path,
+    dst: Path,
+    manifest: Path,
+    files: list[str] | None = None,
+    prefix: str = "",
+    ignore=(),
+    include=(),
+    exclude=(),
+    keep=(),
+    use_hash=False,
+) -> list[str]:
+    """
+    Make `dst` mirror `src` (or just `files` within `src`, placed under
+    `dst/prefix`) while touching as little as possible.
+
+    A file is copied only if it is missing from `dst`, if the copy in `dst`
+    was modified, or if its size/mtime differ from the ones recorded in
+    `manifest` by the previous sync (with `use_hash`, a differing mtime alone
+    is confirmed with a sha256 first). Anything else in `dst` is deleted,
+    except for paths with a part matching one of the `keep` patterns.
+
+    Returns the paths (relative to `dst`) that were copied or deleted.
+    """
+    src, dst, manifest = Path(src), Path(dst), Path(manifest)
+    previous = json.loads(manifest.read_text()) if manifest.is_file() else {}
+    if files is None:
+        files = walk_tree(src, ignore, include, exclude)
+
+    current = {}
+    changed = []
+    for rel in files:
+        s = src / rel
+        d = dst / prefix / rel
+        target = (Path(prefix) / rel).as_posix()
+        st = s.stat()
+        entry = dict(size=st.st_size, mtime_ns=st.st_mtime_ns)
+        prev = previous.get(target, {})
+
+        dst_ok = False
+        if d.is_file():
+            dst_st = d.stat()
+            entry["dst"] = [dst_st.st_size, dst_st.st_mtime_ns]
+            # A hardlink is the source itself, checking the source is enough
+            dst_ok = os.path.samestat(st, dst_st) or entry["dst"] == prev.get("dst")
+
+        if dst_ok and all(prev.get(k) == v for k, v in entry.items()):
+            current[target] = prev
+            continue
+        if dst_ok and use_hash and prev.get("sha256"):
+            entry["sha256"] = _sha256(s)
+            if entry["sha256"] == prev["sha256"]:
+                current[target] = entry
+                continue
+
+        d.parent.mkdir(parents=True, exist_ok=True)
+        SHELL.stage(s, d, read_only=True)
+        if use_hash and "sha256" not in entry:
+            entry["sha256"] = _sha256(s)
+        if d.is_file():
+            dst_st = d.stat()
+            entry["dst"] = [dst_st.st_size, dst_st.st_mtime_ns]
+        current[target] = entry
+        changed.append(target)
+
+    # Remove anything that is no longer part of the source
+    if dst.is_dir():
+        for root, dirs, names in os.walk(dst, topdown=False):
+            for name in names:
+                rel = (Path(root) / name).relative_to(dst).as_posix()
+                if any(fnmatch(x, k) for x in rel.split("/") for k in keep):
+                    continue
+                if rel not in current:
+                    SHELL.remove(Path(root) / name)
+                    changed.append(rel)
+            if not SHELL.mock and Path(root) != dst and not os.listdir(root):
+                os.rmdir(root)
+
+    if not SHELL.mock:
+        manifest.parent.mkdir(parents=True, exist_ok=True)
+        manifest.write_text(json.dumps(current))
+    return changed
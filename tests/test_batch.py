@@ -0,0 +1,30 @@
+import pytest
+
+from widgetron.batch import load_manifest
+
+MANIFEST = """\
+defaults:
+  channels: [conda-forge]
+  strip_source_maps: true
+apps:
+  - notebook: sales.ipynb
+    version: 1.10
+  - notebook: inventory
+    name: Inventory Manager
+    version: 2
+"""
+
+
+def test_manifest_numbers_as_written(tmp_path):
+    (tmp_path / "apps.yml").write_text(MANIFEST)
+    sales, inventory = load_manifest(tmp_path / "apps.yml")
+    assert sales["version"] == "1.10"
+    assert inventory["version"] == "2"
+    assert inventory["channels"] == ["conda-forge"]
+    assert inventory["strip_source_maps"] is True
+
+
+def test_manifest_rejects_boa(tmp_path):
+    (tmp_path / "apps.yml").write_text(MANIFEST + "    package_mode: boa\n")
+    with pytest.raises(AssertionError, match="package_mode"):
+        load_manifest(tmp_path / "apps.yml")
@@ -0,0 +1,42 @@
+import os
+import subprocess
+import sys
+
+# Only needed once a build actually starts
+HEAVY = {
+    "jinja2",
+    "traitlets",
+    "urllib.request",
+    "widgetron.utils.conda",
+    "widgetron.utils.settings",
+    "yaml",
+}
+
+
+def imported_by_help(env) -> set[str]:
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-m", "widgetron", "-h"],
+        env=env,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    assert "usage:" in result.stdout
+    return {
+        line.rsplit("|", 1)[1].strip()
+        for line in result.stderr.splitlines()
+        if line.startswith("import time:") and line.count("|") == 2
+    }
+
+
+def test_help_skips_build_machinery(tmp_path):
+    env = dict(
+        os.environ,
+        PYTHONPATH=os.pathsep.join(sys.path),
+        WIDGETRON_CACHE_DIR=str(tmp_path),
+    )
+    # The first run parses args.yml, later ones read the cached schema
+    imported_by_help(env)
+    modules = imported_by_help(env)
+    assert "widgetron.parse_args" in modules
+    assert not HEAVY & modules
@@ -0,0 +1,31 @@
+import contextvars
+import os
+
+from widgetron.utils.shell import Shell, use_shell
+from widgetron.utils.sync import sync_tree
+
+
+def test_touched_hardlinked_source_is_not_copied(tmp_path):
+    contextvars.copy_context().run(touch_hardlinked_source, tmp_path)
+
+
+def touch_hardlinked_source(tmp_path):
+    use_shell(Shell(staging="hardlink", log=str(tmp_path / "commands.log")))
+    src, dst = tmp_path / "src", tmp_path / "dst"
+    src.mkdir()
+    (src / "app.ipynb").write_text("{}")
+    options = dict(src=src, dst=dst, manifest=tmp_path / "sync.json", use_hash=True)
+
+    assert sync_tree(**options) == ["app.ipynb"]
+    assert os.path.samefile(src / "app.ipynb", dst / "app.ipynb")
+
+    # Saved again without changes
+    st = (src / "app.ipynb").stat()
+    os.utime(src / "app.ipynb", ns=(st.st_atime_ns, st.st_mtime_ns + 10**9))
+    assert sync_tree(**options) == []
+    assert sync_tree(**options) == []
+    assert (tmp_path / "commands.log").read_text().count("stage[") == 1
+
+    (src / "app.ipynb").write_text('{"cells": []}')
+    assert sync_tree(**options) == ["app.ipynb"]
+    assert (dst / "app.ipynb").read_text() == '{"cells": []}'
@@ -0,0 +1,60 @@
+import json
+import os
+import platform
+import subprocess
+import sys
+import zipfile
+from pathlib import Path
+
+from widgetron.utils.conda import uninstall_widgetron
+from widgetron.utils.jinja_functions import _render
+from widgetron.utils.package import site_packages
+
+PYTHON_VERSION = ".".join(map(str, sys.version_info[:2]))
+# The launcher each platform's electron-builder zip holds
+UI = {
+    "Darwin": "widgetron.app/Contents/MacOS/widgetron",
+    "Windows": "widgetron.exe",
+}.get(platform.system(), "widgetron")
+
+
+def install(prefix: Path) -> Path:
+    """Lay out widgetron_app as `conda install` would, post-link excluded."""
+    site = prefix / site_packages(PYTHON_VERSION)
+    package = site / "widgetron_app"
+    package.mkdir(parents=True)
+    (package / "__init__.py").write_text("")
+    (package / "extract.py").write_text(
+        _render("server/widgetron_app/extract.py_template")
+    )
+    (package / "ui.stamp").write_text("abc")
+    # electron-builder's zips may not have a single top-level directory
+    with zipfile.ZipFile(package / "widgetron-linux.zip", "w") as z:
+        z.writestr(UI, "")
+        z.writestr("resources/app.asar", "")
+        z.writestr("libffmpeg.so", "")
+
+    files = [p.relative_to(prefix).as_posix() for p in package.iterdir()]
+    (prefix / "conda-meta").mkdir()
+    record = dict(name="widgetron_app", version="0.0.1", files=files)
+    (prefix / "conda-meta/widgetron_app-0.0.1-py_0.json").write_text(
+        json.dumps(record)
+    )
+    return package
+
+
+def test_uninstall_removes_extracted_ui(tmp_path):
+    package = install(tmp_path)
+    # What the post-link script runs
+    subprocess.check_call(
+        [sys.executable, "-m", "widgetron_app.extract"],
+        env=dict(os.environ, PYTHONPATH=str(package.parent)),
+    )
+    assert (package / "ui.json").is_file()
+    assert not list(package.glob("*.zip"))
+
+    uninstall_widgetron(tmp_path)
+
+    left = [p for p in package.rglob("*") if p.is_file() and "__pycache__" not in p.parts]
+    assert left == []
+    assert not list((tmp_path / "conda-meta").glob("*.json"))